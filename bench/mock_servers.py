@@ -0,0 +1,306 @@
+"""
+Minimal stand-ins for Paperless-ngx and Ollama, serving only what paper-llama uses.
+
+Both servers count requests per route (IDs replaced by {id}) and can add latency,
+so a benchmark measures paper-llama and not the network or the GPU.
+"""
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+ENTITY_ENDPOINTS = ("tags", "correspondents", "document_types")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data, status: int = 200):
+        self._send(status, json.dumps(data).encode())
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        self.server.mock.count(method, url.path)
+        if self.server.mock.latency:
+            time.sleep(self.server.mock.latency)
+        self.server.mock.handle(self, method, url.path, {k: v[-1] for k, v in parse_qs(url.query).items()})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing keep-alive connections or streams early are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockServer:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests: Counter = Counter()
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.mock = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def count(self, method: str, path: str):
+        route = re.sub(r"/\d+", "/{id}", path)
+        with self._lock:
+            self.requests[f"{method} {route}"] += 1
+
+    def handle(self, handler: _Handler, method: str, path: str, query: Dict[str, str]):
+        raise NotImplementedError
+
+
+class MockPaperless(MockServer):
+    """
+    Paginated tags/correspondents/document types with the `all` ID list, the
+    AI Processed custom field, document list/detail/download, PATCH and bulk_edit.
+    """
+
+    def __init__(self, documents: List[dict], names: Dict[str, List[str]], latency: float = 0.0):
+        super().__init__(latency)
+        self.entities = {endpoint: dict(enumerate(names.get(endpoint, []), start=1)) for endpoint in ENTITY_ENDPOINTS}
+        self.custom_fields: Dict[int, dict] = {}
+        self.documents = {doc["id"]: doc for doc in documents}
+
+    def processed_count(self) -> int:
+        with self._lock:
+            return sum(self._is_processed(doc) for doc in self.documents.values())
+
+    def _is_processed(self, doc: dict) -> bool:
+        return any(cf.get("value") is True for cf in doc.get("custom_fields", []))
+
+    def handle(self, handler, method, path, query):
+        parts = [p for p in path.split("/") if p][1:]  # without "api"
+        with self._lock:
+            if parts and parts[0] in ENTITY_ENDPOINTS:
+                return self._entities(handler, method, parts[0], query)
+            if parts == ["custom_fields"]:
+                return self._custom_fields(handler, method, query)
+            if parts == ["documents"]:
+                return self._document_list(handler, query)
+            if parts == ["documents", "bulk_edit"]:
+                return self._bulk_edit(handler, handler._body())
+            if len(parts) >= 2 and parts[0] == "documents" and parts[1].isdigit():
+                doc = self.documents.get(int(parts[1]))
+                if doc is None:
+                    return handler._json({"detail": "Not found."}, 404)
+                if parts[2:] == ["download"]:
+                    return handler._send(200, doc["pdf"], "application/pdf")
+                if method == "PATCH":
+                    doc.update(handler._body())
+                return handler._json({k: v for k, v in doc.items() if k != "pdf"})
+        handler._json({"detail": "Not found."}, 404)
+
+    def _page(self, handler, query, items: List[dict], all_ids: List[int]):
+        page_size = int(query.get("page_size", 25))
+        page = int(query.get("page", 1))
+        start = (page - 1) * page_size
+        next_url = None
+        if start + page_size < len(items):
+            next_url = f"{self.url}{urlparse(handler.path).path}?{urlencode({**query, 'page': page + 1})}"
+        handler._json({
+            "count": len(items), "next": next_url, "previous": None,
+            "results": items[start:start + page_size], "all": all_ids,
+        })
+
+    def _entities(self, handler, method, endpoint, query):
+        items = self.entities[endpoint]
+        if method == "POST":
+            name = handler._body()["name"]
+            if any(existing.lower() == name.lower() for existing in items.values()):
+                return handler._json({"name": [f"{name} already exists."]}, 400)
+            id_ = max(items, default=0) + 1
+            items[id_] = name
+            return handler._json({"id": id_, "name": name}, 201)
+        ids = sorted(items)
+        if "name__iexact" in query:
+            ids = [i for i in ids if items[i].lower() == query["name__iexact"].lower()]
+        if "id__in" in query:
+            wanted = {int(i) for i in query["id__in"].split(",")}
+            ids = [i for i in ids if i in wanted]
+        self._page(handler, query, [{"id": i, "name": items[i]} for i in ids], ids)
+
+    def _custom_fields(self, handler, method, query):
+        if method == "POST":
+            id_ = len(self.custom_fields) + 1
+            self.custom_fields[id_] = {"id": id_, **handler._body()}
+            return handler._json(self.custom_fields[id_], 201)
+        name = query.get("name__iexact", "").lower()
+        fields = [f for f in self.custom_fields.values() if not name or f["name"].lower() == name]
+        self._page(handler, query, fields, [f["id"] for f in fields])
+
+    def _document_list(self, handler, query):
+        if query.get("ordering") == "id":
+            docs = sorted(self.documents.values(), key=lambda d: d["id"])
+        else:
+            docs = sorted(self.documents.values(), key=lambda d: d["created"], reverse=True)
+        if "custom_field_query" in query:
+            docs = [d for d in docs if not self._is_processed(d)]
+        ids = [d["id"] for d in docs]
+        if query.get("fields") == "id":
+            results = [{"id": i} for i in ids]
+        else:
+            results = [{k: v for k, v in d.items() if k != "pdf"} for d in docs]
+        self._page(handler, query, results, ids)
+
+    def _bulk_edit(self, handler, body):
+        params = body.get("parameters", {})
+        for doc_id in body.get("documents", []):
+            doc = self.documents[doc_id]
+            method = body["method"]
+            if method == "set_correspondent":
+                doc["correspondent"] = params["correspondent"]
+            elif method == "set_document_type":
+                doc["document_type"] = params["document_type"]
+            elif method == "modify_tags":
+                doc["tags"] = sorted((set(doc["tags"]) | set(params["add_tags"])) - set(params["remove_tags"]))
+            elif method == "modify_custom_fields":
+                fields = {cf["field"]: cf["value"] for cf in doc.get("custom_fields", [])}
+                fields.update({int(f): v for f, v in params.get("add_custom_fields", {}).items()})
+                doc["custom_fields"] = [{"field": f, "value": v} for f, v in fields.items()]
+        handler._json({"result": "OK"})
+
+
+class MockOllama(MockServer):
+    """
+    /api/generate (OCR with images, classification otherwise, optionally streamed)
+    and /api/embed. Each generation waits `latency` seconds for prompt processing,
+    then produces tokens at `tokens_per_second`. Up to `parallel` generations run
+    at once (OLLAMA_NUM_PARALLEL), further requests wait.
+    """
+
+    def __init__(self, names: Dict[str, List[str]], latency: float = 0.5, tokens_per_second: float = 30.0,
+                 ocr_chars: int = 1500, embed_dim: int = 256, parallel: int = 1):
+        super().__init__(0.0)
+        self.names = names
+        self.generate_latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.ocr_chars = ocr_chars
+        self.embed_dim = embed_dim
+        self.loaded = set()  # models reported by /api/ps
+        self._slots = threading.Semaphore(parallel)
+
+    def handle(self, handler, method, path, query):
+        body = handler._body()
+        if path == "/api/embed":
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            return handler._json({"embeddings": [self._vector(text) for text in inputs]})
+        if path == "/api/version":
+            return handler._json({"version": "0.0.0-mock"})
+        if path == "/api/ps":
+            return handler._json({"models": [{"name": name, "model": name} for name in sorted(self.loaded)]})
+        if path != "/api/generate":
+            return handler._json({"error": "not found"}, 404)
+        model = body.get("model", "")
+        self.loaded.add(model if ":" in model else f"{model}:latest")
+
+        if body.get("options", {}).get("num_predict") == 1 or not body.get("prompt"):
+            return handler._json({"response": "", "done": True})  # warm-up / model load
+        if body.get("images"):
+            text = " ".join(random.choice(_WORDS) for _ in range(self.ocr_chars // 6))
+        elif doc_ids := re.findall(r"^### Document (\d+)$", body["prompt"], re.MULTILINE):
+            text = json.dumps({doc_id: self._classification() for doc_id in doc_ids})
+        else:
+            text = json.dumps(self._classification())
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+
+        with self._slots:
+            time.sleep(self.generate_latency)
+            if body.get("stream", True):
+                return self._stream(handler, tokens)
+            time.sleep(len(tokens) / self.tokens_per_second)
+        handler._json({"response": text, "done": True, **self._stats(len(tokens))})
+
+    def _stream(self, handler, tokens: List[str]):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/x-ndjson")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+        def chunk(data: dict):
+            line = json.dumps(data).encode() + b"\n"
+            handler.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            handler.wfile.flush()
+
+        try:
+            for token in tokens:
+                time.sleep(1 / self.tokens_per_second)
+                chunk({"response": token, "done": False})
+            chunk({"response": "", "done": True, **self._stats(len(tokens))})
+            handler.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            handler.close_connection = True  # client stopped reading once the JSON was complete
+
+    def _stats(self, tokens: int) -> dict:
+        return {
+            "prompt_eval_count": 1000, "prompt_eval_duration": int(self.generate_latency * 1e9),
+            "eval_count": tokens, "eval_duration": int(tokens / self.tokens_per_second * 1e9),
+        }
+
+    def _classification(self) -> dict:
+        correspondents = self.names.get("correspondents") or ["ACME"]
+        # Mostly existing names, sometimes a new one, like a real model
+        correspondent = random.choice(correspondents) if random.random() < 0.9 else f"New Company {random.randint(1, 10**6)}"
+        return {
+            "title": " ".join(random.choice(_WORDS) for _ in range(4)).capitalize(),
+            "created": f"20{random.randint(10, 25)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+            "correspondent": correspondent,
+            "document_type": random.choice(self.names.get("document_types") or ["Invoice"]),
+            "tags": random.sample(self.names.get("tags") or ["Bench"], k=min(2, len(self.names.get("tags") or ["Bench"]))),
+        }
+
+    def _vector(self, text: str) -> List[float]:
+        rng = random.Random(hashlib.sha256(text.encode()).digest())
+        return [rng.uniform(-1, 1) for _ in range(self.embed_dim)]
+
+
+_WORDS = (
+    "invoice payment total amount due date customer account number order delivery address "
+    "contract agreement period service tax net gross bank transfer reference page item quantity"
+).split()
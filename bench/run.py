@@ -0,0 +1,258 @@
+"""
+Benchmark paper-llama against local Paperless and Ollama stand-ins.
+
+Run from the repository root:
+
+    python -m bench.run --docs 200 --pages 1,2,5 --workers 2 --ocr-source llm
+
+Measures metadata loading (cold and from the on-disk cache), then processes the
+generated corpus through the same queue and auto mode loop as in production and
+reports documents/minute, p50/p99 per stage, peak RSS and HTTP request counts.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from PIL import Image, ImageDraw
+
+from bench.mock_servers import MockOllama, MockPaperless
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="paper-llama benchmark")
+    parser.add_argument("--docs", type=int, default=50, help="Number of documents in the corpus")
+    parser.add_argument("--pages", default="1,2,5", help="Page counts of generated PDFs, used in turn")
+    parser.add_argument("--ocr-source", choices=["paperless", "llm"], default="paperless")
+    parser.add_argument("--workers", type=int, default=1, help="WORKERS (queue worker threads)")
+    parser.add_argument("--llm-concurrency", type=int, default=1, help="LLM_CONCURRENCY")
+    parser.add_argument("--ollama-parallel", type=int, help="Generations each mock ollama host runs at once "
+                        "(OLLAMA_NUM_PARALLEL), defaults to --llm-concurrency")
+    parser.add_argument("--tags", type=int, default=500, help="Existing tags in Paperless")
+    parser.add_argument("--correspondents", type=int, default=300, help="Existing correspondents in Paperless")
+    parser.add_argument("--document-types", type=int, default=20, help="Existing document types in Paperless")
+    parser.add_argument("--ollama-hosts", type=int, default=1, help="Number of mock ollama hosts (comma separated OLLAMA_URL)")
+    parser.add_argument("--ollama-latency", type=float, default=0.2, help="Seconds of prompt processing per request")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Generation speed of the mock model")
+    parser.add_argument("--paperless-latency", type=float, default=0.005, help="Seconds added to every Paperless request")
+    parser.add_argument("--timeout", type=float, default=1800, help="Give up after this many seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the report to this file")
+    return parser.parse_args()
+
+
+def make_pdf(doc_id: int, pages: int) -> bytes:
+    """Image-only PDF (like a scan) with a few lines of text per page."""
+    images = []
+    for page in range(pages):
+        image = Image.new("L", (1240, 1754), 255)  # A4 at 150 DPI
+        draw = ImageDraw.Draw(image)
+        for line in range(40):
+            draw.text((100, 100 + line * 38), f"Document {doc_id} page {page + 1} line {line + 1} amount {random.randint(1, 9999)}.00", fill=0)
+        images.append(image)
+    buffered = io.BytesIO()
+    images[0].save(buffered, format="PDF", save_all=True, append_images=images[1:], resolution=150)
+    return buffered.getvalue()
+
+
+def make_corpus(args) -> tuple:
+    names = {
+        "tags": [f"Tag {i}" for i in range(args.tags)],
+        "correspondents": [f"Company {i} d.o.o." for i in range(args.correspondents)],
+        "document_types": [f"Type {i}" for i in range(args.document_types)],
+    }
+    page_counts = [int(p) for p in args.pages.split(",")]
+    documents = []
+    for doc_id in range(1, args.docs + 1):
+        pages = page_counts[doc_id % len(page_counts)]
+        documents.append({
+            "id": doc_id,
+            "title": f"scan_{doc_id:05d}",
+            "content": "\n".join(f"Line {line} of document {doc_id}, page {line // 40 + 1}" for line in range(pages * 40)),
+            "tags": [],
+            "correspondent": None,
+            "document_type": None,
+            "created": f"2024-01-{doc_id % 28 + 1:02d}T00:00:00Z",
+            "custom_fields": [],
+            # A PDF per document: OCR checkpoints and caches are keyed by its bytes
+            "pdf": make_pdf(doc_id, pages) if args.ocr_source == "llm" else b"",
+        })
+    return documents, names
+
+
+class StageRecorder:
+    """Drop-in for metrics.STAGE_SECONDS keeping every observation, for exact percentiles."""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def labels(self, stage: str):
+        recorder = self
+
+        class _Child:
+            def observe(self, value: float):
+                with recorder._lock:
+                    recorder.samples[stage].append(value)
+                recorder.histogram.labels(stage).observe(value)
+
+        return _Child()
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    documents, names = make_corpus(args)
+    paperless = MockPaperless(documents, names, latency=args.paperless_latency).start()
+    ollamas = [
+        MockOllama(names, latency=args.ollama_latency, tokens_per_second=args.tokens_per_second,
+                   parallel=args.ollama_parallel or args.llm_concurrency).start()
+        for _ in range(args.ollama_hosts)
+    ]
+    data_dir = tempfile.mkdtemp(prefix="paperllama-bench-")
+
+    # Settings are read on import, so the environment has to be in place first
+    os.environ.update({
+        "PAPERLESS_URL": paperless.url,
+        "PAPERLESS_TOKEN": "bench",
+        "OLLAMA_URL": ",".join(ollama.url for ollama in ollamas),
+        "OLLAMA_MODEL": "bench",
+        "OLLAMA_NUM_CTX": "8192",
+        "OCR_SOURCE": args.ocr_source,
+        "LLM_OCR_SOURCE_PAGE_LIMIT": "1000",
+        "WORKERS": str(args.workers),
+        "LLM_CONCURRENCY": str(args.llm_concurrency),
+        "DATA_DIR": data_dir,
+        "RESULT_CACHE_MAX_ENTRIES": "0",
+        "METADATA_REFRESH_INTERVAL": "60",
+        "SCAN_INTERVAL": "3600",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+    from src import metrics
+    from src.job_queue import JobQueue
+    from src.paperless_client import PaperlessClient
+    from src.llm_client import OllamaClient
+    from src.processor import process_queued_document, run_auto_mode
+    from src.scheduler import AdaptiveScheduler
+
+    recorder = StageRecorder(metrics.STAGE_SECONDS)
+    metrics.STAGE_SECONDS = recorder
+    report = {"config": {k: v for k, v in vars(args).items() if k != "json"}}
+
+    # Metadata: first start without a cache, then a restart that finds the cache on disk
+    requests_before = sum(paperless.requests.values())
+    start = time.perf_counter()
+    PaperlessClient().refresh_metadata()
+    cold = time.perf_counter() - start
+    cold_requests = sum(paperless.requests.values()) - requests_before
+
+    p_client = PaperlessClient()
+    requests_before = sum(paperless.requests.values())
+    start = time.perf_counter()
+    p_client.refresh_metadata()
+    warm = time.perf_counter() - start
+    report["refresh_metadata"] = {
+        "cold_seconds": round(cold, 3), "cold_requests": cold_requests,
+        "cached_seconds": round(warm, 3), "cached_requests": sum(paperless.requests.values()) - requests_before,
+    }
+    paperless.requests.clear()
+    for ollama in ollamas:
+        ollama.requests.clear()
+    recorder.reset()
+
+    # Processing: the auto mode loop feeds the queue, workers drain it
+    o_client = OllamaClient()
+    queue = JobQueue(os.path.join(data_dir, "queue.sqlite3"))
+    queue.start_workers(lambda doc_id: process_queued_document(doc_id, p_client, o_client, False), args.workers)
+    start = time.perf_counter()
+    scheduler = AdaptiveScheduler(queue, o_client)
+    threading.Thread(target=run_auto_mode, args=(p_client, queue, scheduler), daemon=True).start()
+    while paperless.processed_count() < len(documents) and time.perf_counter() - start < args.timeout:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    processed = paperless.processed_count()
+    # Workers finish a job after its update (checkpoint cleanup), let them before the data dir is removed
+    while queue.stats()["running"] and time.perf_counter() - start < args.timeout:
+        time.sleep(0.05)
+
+    report["processing"] = {
+        "documents": processed,
+        "seconds": round(elapsed, 2),
+        "documents_per_minute": round(processed / elapsed * 60, 1),
+        "failed_jobs": queue.stats()["failed"],
+    }
+    report["stages"] = {
+        stage: {
+            "count": len(values),
+            "p50": round(percentile(values, 50), 4),
+            "p99": round(percentile(values, 99), 4),
+            "total": round(sum(values), 2),
+        }
+        for stage, values in sorted(recorder.samples.items())
+    }
+    report["http_requests"] = {
+        "paperless": dict(sorted(paperless.requests.items())),
+        **{
+            f"ollama{i + 1}" if len(ollamas) > 1 else "ollama": dict(sorted(ollama.requests.items()))
+            for i, ollama in enumerate(ollamas)
+        },
+    }
+
+    from src import preprocess
+    if preprocess._pool:
+        preprocess._pool.shutdown()
+    # ru_maxrss is in KiB on Linux
+    report["peak_rss_mb"] = {
+        "main": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    shutil.rmtree(data_dir, ignore_errors=True)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if processed < len(documents):
+        print(f"\nOnly {processed} of {len(documents)} documents were processed before the timeout", file=sys.stderr)
+        sys.exit(1)
+
+
+def print_report(report: dict):
+    meta = report["refresh_metadata"]
+    proc = report["processing"]
+    print(f"refresh_metadata: cold {meta['cold_seconds']}s ({meta['cold_requests']} requests), "
+          f"from cache {meta['cached_seconds']}s ({meta['cached_requests']} requests)")
+    print(f"processed {proc['documents']} documents in {proc['seconds']}s: "
+          f"{proc['documents_per_minute']} documents/minute, {proc['failed_jobs']} failed")
+    print(f"\n{'stage':<20}{'count':>8}{'p50 s':>10}{'p99 s':>10}{'total s':>10}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<20}{s['count']:>8}{s['p50']:>10}{s['p99']:>10}{s['total']:>10}")
+    print("\nHTTP requests")
+    for server, counts in report["http_requests"].items():
+        for route, count in counts.items():
+            print(f"  {server:<10}{route:<45}{count:>8}")
+    rss = report["peak_rss_mb"]
+    print(f"\npeak RSS: {rss['main']} MB, preprocessing processes {rss['children']} MB")
+
+
+if __name__ == "__main__":
+    main()
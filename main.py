@@ -1,17 +1,27 @@
 import argparse
 import sys
 import threading
+from prometheus_client import start_http_server
+from src.config import settings
 from src.paperless_client import PaperlessClient
 from src.llm_client import OllamaClient
-from src.utils import logger, get_user_prompt
-from src.processor import process_single_document, run_auto_mode
+from src.job_queue import JobQueue
+from src.scheduler import AdaptiveScheduler
+from src.utils import logger, get_user_prompt, sqlite_path
+from src.processor import process_single_document, process_queued_document, run_auto_mode
 from src.webhook import run_webhook_mode
+from src.backfill import Journal, apply_journal, default_journal_path, parse_id_range, parse_shard, run_backfill, select_documents
 
 
 def run():
     parser = argparse.ArgumentParser(description="PaperLlama")
-    parser.add_argument("--mode", choices=["auto", "manual", "webhook"], default="auto", help="Execution mode")
+    parser.add_argument("--mode", choices=["auto", "manual", "webhook", "backfill", "apply"], default="auto", help="Execution mode")
     parser.add_argument("--doc-id", type=int, help="Document ID for manual mode")
+    parser.add_argument("--id-range", help="Backfill: document IDs, e.g. 1-5000")
+    parser.add_argument("--query", help="Backfill: paperless full text query selecting documents")
+    parser.add_argument("--include-processed", action="store_true", help="Backfill: also documents already AI processed")
+    parser.add_argument("--shard", default="1/1", help="Backfill: process shard i of N, e.g. 2/4")
+    parser.add_argument("--journal", help="Backfill/apply: results journal, defaults to data/backfill[-i-of-N].jsonl")
     parser.add_argument("--dry-run", action="store_true", help="Log changes without applying them to Paperless")
     
     args = parser.parse_args()
@@ -23,7 +33,19 @@ def run():
         logger.critical(f"Initialization failed: {e}")
         sys.exit(1)
 
+    def warm_up():
+        try:
+            p_client.refresh_metadata()
+            o_client.warm_up(get_user_prompt(p_client))
+        except Exception as e:
+            logger.warning(f"Warm-up failed, continuing: {e}")
 
+    if settings.ollama_warm_up and args.mode != "apply":
+        if args.mode in ("auto", "webhook"):
+            # Loading models can take minutes; meanwhile webhooks are accepted and documents queued
+            threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+        else:
+            warm_up()
 
     if args.mode == "manual":
         if not args.doc_id:
@@ -32,22 +54,52 @@ def run():
         p_client.refresh_metadata()
         prompt = get_user_prompt(p_client)
         process_single_document(args.doc_id, prompt, p_client, o_client, args.dry_run)
+
+    elif args.mode in ("backfill", "apply"):
+        try:
+            shard = parse_shard(args.shard)
+            id_range = parse_id_range(args.id_range) if args.id_range else (None, None)
+        except ValueError as e:
+            logger.error(str(e))
+            sys.exit(1)
+        journal = Journal(args.journal or default_journal_path(shard))
+        p_client.refresh_metadata()
+        if args.mode == "apply":
+            apply_journal(p_client, journal, args.dry_run)
+        else:
+            if settings.metrics_port:
+                start_http_server(settings.metrics_port)
+                logger.info(f"Serving metrics on port {settings.metrics_port}")
+            doc_ids = select_documents(p_client, id_range, args.query, shard, args.include_processed)
+            run_backfill(p_client, o_client, doc_ids, journal, args.dry_run)
         
-    elif args.mode == "auto":
-        run_auto_mode(p_client, o_client, args.dry_run)
-        
-    elif args.mode == "webhook":
-        # Start auto mode in a background thread
-        logger.info("Starting auto mode in background...")
-        polling_thread = threading.Thread(
-            target=run_auto_mode, 
-            args=(p_client, o_client, args.dry_run),
-            daemon=True
+    else:
+        # Auto and webhook mode share one persistent queue, processed by WORKERS threads
+        queue = JobQueue(sqlite_path("queue.sqlite3"))
+        queue.start_workers(
+            lambda doc_id: process_queued_document(doc_id, p_client, o_client, args.dry_run),
+            settings.workers
         )
-        polling_thread.start()
-        
-        # Start webhook mode (blocking)
-        run_webhook_mode(p_client, o_client, args.dry_run)
+        scheduler = AdaptiveScheduler(queue, o_client)
+
+        if args.mode == "auto":
+            if settings.metrics_port:
+                start_http_server(settings.metrics_port)
+                logger.info(f"Serving metrics on port {settings.metrics_port}")
+            run_auto_mode(p_client, queue, scheduler)
+
+        elif args.mode == "webhook":
+            # Start auto mode in a background thread
+            logger.info("Starting auto mode in background...")
+            polling_thread = threading.Thread(
+                target=run_auto_mode, 
+                args=(p_client, queue, scheduler),
+                daemon=True
+            )
+            polling_thread.start()
+            
+            # Start webhook mode (blocking)
+            run_webhook_mode(queue, scheduler)
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from src.config import settings
+from src.paperless_client import PaperlessClient
+from src.llm_client import OllamaClient
+from src.bulk_updater import BulkUpdater
+from src.checkpoints import get_checkpoints
+from src.models import LLMResponse, PaperlessDocument
+from src.processor import classify_document
+from src.utils import logger, get_user_prompt
+from src import metrics
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """"i/N" -> (i, N), shards are numbered from 1."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value!r}, expected i/N, e.g. 2/4")
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {value!r}, i must be between 1 and N")
+    return index, count
+
+
+def parse_id_range(value: str) -> Tuple[Optional[int], Optional[int]]:
+    """"100-200" -> (100, 200), either end may be left out ("100-", "-200")."""
+    first, sep, last = value.partition("-")
+    try:
+        if not sep:
+            return int(first), int(first)
+        return int(first) if first else None, int(last) if last else None
+    except ValueError:
+        raise ValueError(f"Invalid ID range {value!r}, expected e.g. 1-5000")
+
+
+def default_journal_path(shard: Tuple[int, int]) -> str:
+    index, count = shard
+    name = "backfill.jsonl" if count == 1 else f"backfill-{index}-of-{count}.jsonl"
+    return os.path.join(settings.data_dir, name)
+
+
+def select_documents(p_client: PaperlessClient, id_range: Tuple[Optional[int], Optional[int]] = (None, None),
+                     query: Optional[str] = None, shard: Tuple[int, int] = (1, 1),
+                     include_processed: bool = False) -> List[int]:
+    """
+    IDs of the documents of a backfill, in ascending order.
+
+    Documents are assigned to shards by ID (ID modulo N), so every process or host
+    running with the same selection and its own --shard gets a distinct part of it,
+    without any coordination.
+    """
+    first, last = id_range
+    index, count = shard
+    doc_ids = []
+    for doc_id in p_client.iter_document_ids(query, not include_processed, ordering="id", page_size=1000):
+        if last is not None and doc_id > last:
+            if query:
+                continue  # paperless orders full text results by relevance, not by ID
+            break
+        if (first is None or doc_id >= first) and doc_id % count == index - 1:
+            doc_ids.append(doc_id)
+    return sorted(doc_ids)
+
+
+class Journal:
+    """
+    Results of a backfill, a JSONL file with one line per classified document:
+
+        {"id": 12, "title": "scan_0012", "result": {...}, "content": "..."}
+
+    "content" is only there when the document was OCR-ed by the LLM. Applied results
+    are marked by appending {"id": 12, "applied": true}. The file can be reviewed and
+    edited before it is applied; the last line of a document wins.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def entries(self) -> Dict[int, dict]:
+        """Document ID -> its lines merged."""
+        entries: Dict[int, dict] = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path) as f:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # e.g. the last line of an interrupted run
+                    logger.warning(f"Skipping invalid line {number} of {self.path}")
+                    continue
+                entries.setdefault(entry["id"], {}).update(entry)
+        return entries
+
+    def append(self, entry: dict):
+        self._write([entry])
+
+    def mark_applied(self, doc_ids: Iterable[int]):
+        self._write([{"id": doc_id, "applied": True} for doc_id in doc_ids])
+
+    def _write(self, entries: List[dict]):
+        if not entries:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+
+class Progress:
+    """Logs how far a backfill got and when it will be done."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, ok: bool):
+        with self._lock:
+            self.done += 1
+            self.failed += not ok
+            per_second = self.done / max(time.monotonic() - self._started, 1e-6)
+            eta = timedelta(seconds=round((self.total - self.done) / per_second))
+            logger.info(f"Backfill progress: {self.done}/{self.total} ({self.done / self.total:.1%}), "
+                        f"{self.failed} failed, {per_second * 60:.1f} documents/minute, ETA {eta}")
+
+
+class _Applier:
+    """BulkUpdater shared by worker threads, recording applied results in the journal."""
+
+    def __init__(self, p_client: PaperlessClient, journal: Journal):
+        self.journal = journal
+        self.applied = 0
+        self.failed = 0
+        self._updater = BulkUpdater(p_client)
+        self._lock = threading.Lock()
+
+    def add(self, doc: PaperlessDocument, llm_result: LLMResponse, content: Optional[str]):
+        with self._lock:
+            self._record(self._updater.add(doc, llm_result, content))
+
+    def flush(self):
+        with self._lock:
+            self._record(self._updater.flush())
+
+    def _record(self, results: Dict[int, bool]):
+        self.journal.mark_applied(doc_id for doc_id, ok in results.items() if ok)
+        self.applied += sum(results.values())
+        self.failed += len(results) - sum(results.values())
+
+
+def run_backfill(p_client: PaperlessClient, o_client: OllamaClient, doc_ids: List[int], journal: Journal, dry_run: bool):
+    """
+    Classify documents with WORKERS threads and write the results to the journal.
+
+    Documents already in the journal are skipped, so an interrupted backfill continues
+    where it stopped. Unless dry_run, results are also applied in bulk as they come in
+    (results of a previous run that were not applied yet first).
+    """
+    entries = journal.entries()
+    todo = [doc_id for doc_id in doc_ids if doc_id not in entries]
+    logger.info(f"Backfill of {len(doc_ids)} document(s), {len(doc_ids) - len(todo)} already in {journal.path}")
+    if not dry_run:
+        apply_journal(p_client, journal, dry_run)
+    if not todo:
+        return
+
+    applier = None if dry_run else _Applier(p_client, journal)
+    progress = Progress(len(todo))
+
+    def work(doc_id: int):
+        try:
+            with metrics.time_stage("metadata_refresh"):
+                p_client.refresh_metadata()
+            with metrics.time_stage("document"):
+                doc, llm_result, ocr_text, ocr_key = classify_document(doc_id, get_user_prompt(p_client), p_client, o_client)
+        except Exception as e:
+            metrics.DOCUMENTS.labels("failed").inc()
+            logger.error(f"Error processing document {doc_id}: {e}", exc_info=True)
+            progress.update(False)
+            return
+
+        content = ocr_text if ocr_text != doc.content else None
+        entry = {"id": doc_id, "title": doc.title, "result": llm_result.model_dump()}
+        if content is not None:
+            entry["content"] = content
+        journal.append(entry)
+        # The journal holds the result from now on
+        get_checkpoints().clear(doc_id, ocr_key)
+        metrics.DOCUMENTS.labels("success").inc()
+        if applier:
+            applier.add(doc, llm_result, content)
+        progress.update(True)
+
+    pool = ThreadPoolExecutor(max_workers=settings.workers, thread_name_prefix="backfill")
+    try:
+        for future in [pool.submit(work, doc_id) for doc_id in todo]:
+            future.result()
+    finally:
+        # On Ctrl+C, documents in progress are finished and written, the rest is left for the next run
+        pool.shutdown(cancel_futures=True)
+        if applier:
+            applier.flush()
+            logger.info(f"Backfill applied {applier.applied} result(s), {applier.failed} failed")
+    logger.info(f"Backfill done: {progress.done - progress.failed} classified, {progress.failed} failed, "
+                f"results in {journal.path}")
+
+
+def apply_journal(p_client: PaperlessClient, journal: Journal, dry_run: bool):
+    """Apply the results in the journal that were not applied yet, with bulk edits where possible."""
+    pending = [entry for entry in journal.entries().values() if "result" in entry and not entry.get("applied")]
+    if not pending:
+        logger.info(f"No results to apply in {journal.path}")
+        return
+    if dry_run:
+        for entry in pending:
+            logger.info(f"Document {entry['id']} '{entry.get('title')}': {json.dumps(entry['result'])}")
+        logger.warning(f"Not applying {len(pending)} result(s) due to dry run")
+        return
+
+    logger.info(f"Applying {len(pending)} result(s) from {journal.path}")
+    applier = _Applier(p_client, journal)
+
+    def fetch(entry: dict) -> Optional[PaperlessDocument]:
+        try:
+            return p_client.get_document(entry["id"])
+        except Exception as e:
+            logger.error(f"Could not fetch document {entry['id']}, not applying its result: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=settings.workers, thread_name_prefix="backfill") as pool:
+        for entry, doc in zip(pending, pool.map(fetch, pending)):
+            if doc is not None:
+                applier.add(doc, LLMResponse.model_validate(entry["result"]), entry.get("content"))
+    applier.flush()
+    logger.info(f"Applied {applier.applied} result(s), {applier.failed} failed")
@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional
+from src.config import settings
+from src.models import LLMResponse
+from src.prompt_builder import OLLAMA_DEFAULT_NUM_CTX, PROMPT_OVERHEAD_TOKENS, estimate_tokens
+from src.utils import logger
+from src import metrics
+
+
+class _Item:
+    def __init__(self, doc_id: int, text: str):
+        self.doc_id = doc_id
+        self.text = text
+        self.future: Future = Future()
+
+
+class BatchClassifier:
+    """
+    Packs short documents that are classified at the same time into one request,
+    so the instructions and metadata lists are processed once per batch instead
+    of once per document.
+
+    Worker threads with a short document wait up to BATCH_CLASSIFY_WAIT seconds for
+    others with the same prompt. The thread that fills a batch (BATCH_CLASSIFY_SIZE
+    documents or the context window), or whose wait runs out, sends it. Documents
+    missing or invalid in the answer are classified one by one by their own thread.
+    """
+
+    def __init__(self, o_client):
+        self.o_client = o_client
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[_Item]] = {}
+
+    def classify(self, doc_id: int, prompt: str, text: str) -> LLMResponse:
+        o_client = self.o_client
+        if o_client.cache and (cached := o_client.cache.get(o_client.classification_key(prompt, text), "classification")):
+            return LLMResponse.model_validate_json(cached)
+
+        item = _Item(doc_id, text)
+        to_send = []
+        with self._lock:
+            batch = self._pending.setdefault(prompt, [])
+            if batch and not self._fits(prompt, batch + [item]):
+                to_send.append(self._pending.pop(prompt))
+                batch = self._pending.setdefault(prompt, [])
+            batch.append(item)
+            if len(batch) >= settings.batch_classify_size:
+                to_send.append(self._pending.pop(prompt))
+        for items in to_send:
+            self._send(prompt, items)
+
+        try:
+            result = item.future.result(timeout=settings.batch_classify_wait)
+        except FutureTimeout:
+            with self._lock:
+                mine = self._pending.pop(prompt) if item in self._pending.get(prompt, []) else None
+            if mine:
+                self._send(prompt, mine)
+            result = item.future.result()
+
+        if result is None:
+            metrics.BATCH_DOCUMENTS.labels("single").inc()
+            return o_client.process_document(prompt, text)
+        metrics.BATCH_DOCUMENTS.labels("batched").inc()
+        return result
+
+    def _fits(self, prompt: str, items: List[_Item]) -> bool:
+        num_ctx = settings.ollama_num_ctx or OLLAMA_DEFAULT_NUM_CTX
+        needed = estimate_tokens(prompt) + PROMPT_OVERHEAD_TOKENS + sum(
+            estimate_tokens(item.text) + settings.prompt_output_reserve for item in items
+        )
+        return needed <= num_ctx
+
+    def _send(self, prompt: str, items: List[_Item]):
+        """Classify a batch; documents without a result get None and fall back to a single request."""
+        results: Dict[int, Optional[LLMResponse]] = {}
+        if len(items) > 1:
+            logger.info(f"Classifying {len(items)} short documents in one request")
+            try:
+                results = self.o_client.classify_batch(prompt, [(item.doc_id, item.text) for item in items])
+            except Exception as e:
+                logger.warning(f"Batch classification failed, classifying documents one by one: {e}")
+            missing = [item.doc_id for item in items if item.doc_id not in results]
+            if missing and results:
+                logger.warning(f"No valid batch result for documents {missing}, classifying them one by one")
+        for item in items:
+            item.future.set_result(results.get(item.doc_id))
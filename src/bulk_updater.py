@@ -0,0 +1,159 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional, Tuple
+from src.config import settings
+from src.models import LLMResponse, PaperlessDocument
+from src.paperless_client import PaperlessClient
+from src.utils import logger
+
+# Fields bulk_edit can set on many documents at once, everything else needs a PATCH per document
+SHARED_FIELDS = {"correspondent", "document_type", "tags", "custom_fields"}
+
+
+class BulkUpdater:
+    """
+    Collects classification results and applies them with as few requests as possible.
+
+    On flush, missing tags/correspondents/types of the whole batch are created first.
+    A document whose title, date or content changes still gets its own PATCH, bulk_edit
+    cannot set those. Only documents where the LLM kept title and date (and the OCR
+    text is unchanged) are updated with one bulk_edit call per distinct value.
+    """
+
+    def __init__(self, p_client: PaperlessClient, batch_size: int = 50):
+        self.p_client = p_client
+        self.batch_size = batch_size
+        self._pending: List[Tuple[PaperlessDocument, LLMResponse, Optional[str]]] = []
+
+    def add(self, doc: PaperlessDocument, llm_data: LLMResponse, ocr_text: Optional[str] = None) -> Dict[int, bool]:
+        """Queue a result, flushing when the batch is full. Returns results of a flush, if any."""
+        self._pending.append((doc, llm_data, ocr_text))
+        if len(self._pending) >= self.batch_size:
+            return self.flush()
+        return {}
+
+    def flush(self) -> Dict[int, bool]:
+        """Apply all queued results. Returns document ID -> success."""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return {}
+
+        self.p_client.create_missing([llm_data for _, llm_data, _ in pending])
+
+        results: Dict[int, bool] = {}
+        bulk: Dict[int, dict] = {}
+        for doc, llm_data, ocr_text in pending:
+            payload = self.p_client.build_update_payload(doc, llm_data, ocr_text)
+            if set(payload) - SHARED_FIELDS:
+                results[doc.id] = self.p_client.patch_document(doc.id, payload)
+            else:
+                bulk[doc.id] = {"payload": payload, "old_tags": set(doc.tags)}
+
+        if bulk:
+            results.update(self._apply_bulk(bulk))
+
+        failed = [doc_id for doc_id, ok in results.items() if not ok]
+        logger.info(f"Applied {len(results) - len(failed)}/{len(results)} document updates ({len(bulk)} via bulk edit)")
+        return results
+
+    def _apply_bulk(self, bulk: Dict[int, dict]) -> Dict[int, bool]:
+        ok = {doc_id: True for doc_id in bulk}
+
+        def run(groups: Dict, method: str, parameters):
+            for key, doc_ids in groups.items():
+                if not self.p_client.bulk_edit(doc_ids, method, parameters(key)):
+                    for doc_id in doc_ids:
+                        ok[doc_id] = False
+
+        correspondents = defaultdict(list)
+        types = defaultdict(list)
+        tag_changes = defaultdict(list)
+        for doc_id, item in bulk.items():
+            payload = item["payload"]
+            if "correspondent" in payload:
+                correspondents[payload["correspondent"]].append(doc_id)
+            if "document_type" in payload:
+                types[payload["document_type"]].append(doc_id)
+            new_tags = set(payload["tags"])
+            add, remove = new_tags - item["old_tags"], item["old_tags"] - new_tags
+            if add or remove:
+                tag_changes[(tuple(sorted(add)), tuple(sorted(remove)))].append(doc_id)
+
+        run(correspondents, "set_correspondent", lambda c_id: {"correspondent": c_id})
+        run(types, "set_document_type", lambda dt_id: {"document_type": dt_id})
+        run(tag_changes, "modify_tags", lambda change: {"add_tags": list(change[0]), "remove_tags": list(change[1])})
+
+        # Mark as processed last, and only documents whose other changes were applied
+        done = [doc_id for doc_id, success in ok.items() if success]
+        if done:
+            cf_id = self.p_client._processed_cf_id
+            run({cf_id: done}, "modify_custom_fields",
+                lambda field: {"add_custom_fields": {str(field): True}, "remove_custom_fields": []})
+        return ok
+
+
+class _Item:
+    def __init__(self, doc: PaperlessDocument, llm_data: LLMResponse, ocr_text: Optional[str]):
+        self.doc = doc
+        self.llm_data = llm_data
+        self.ocr_text = ocr_text
+        self.future: Future = Future()
+
+
+class BulkApplier:
+    """
+    Applies the results of queue workers through a shared BulkUpdater.
+
+    A worker waits up to BULK_UPDATE_WAIT seconds for others to finish; the thread
+    that fills a batch (BULK_UPDATE_SIZE results), or whose wait runs out, applies it.
+    """
+
+    def __init__(self, p_client: PaperlessClient):
+        self.p_client = p_client
+        self._lock = threading.Lock()
+        self._pending: List[_Item] = []
+
+    def apply(self, doc: PaperlessDocument, llm_data: LLMResponse, ocr_text: Optional[str] = None) -> bool:
+        item = _Item(doc, llm_data, ocr_text)
+        with self._lock:
+            self._pending.append(item)
+            full = len(self._pending) >= settings.bulk_update_size
+            batch, self._pending = (self._pending, []) if full else (None, self._pending)
+        if batch:
+            self._flush(batch)
+
+        try:
+            return item.future.result(timeout=settings.bulk_update_wait)
+        except FutureTimeout:
+            with self._lock:
+                batch, self._pending = (self._pending, []) if item in self._pending else (None, self._pending)
+            if batch:
+                self._flush(batch)
+            return item.future.result()
+
+    def _flush(self, items: List[_Item]):
+        try:
+            updater = BulkUpdater(self.p_client, len(items) + 1)
+            for item in items:
+                updater.add(item.doc, item.llm_data, item.ocr_text)
+            results = updater.flush()
+        except Exception as e:
+            for item in items:
+                item.future.set_exception(e)
+            return
+        for item in items:
+            item.future.set_result(results.get(item.doc.id, False))
+
+
+_applier: Optional[BulkApplier] = None
+_applier_lock = threading.Lock()
+
+
+def get_bulk_applier(p_client: PaperlessClient) -> BulkApplier:
+    """Bulk applier shared by all queue workers."""
+    global _applier
+    with _applier_lock:
+        if _applier is None:
+            _applier = BulkApplier(p_client)
+        return _applier
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from src.config import settings
+from src.utils import logger, sqlite_path
+
+_store: Optional["CheckpointStore"] = None
+_store_lock = threading.Lock()
+
+
+class CheckpointStore:
+    """
+    Progress of documents being processed, persisted in SQLite, so a restart
+    resumes where processing stopped instead of starting over.
+
+    OCR pages are stored as they complete, keyed by the OCR cache key (PDF and
+    OCR settings), and the classification result per document together with a
+    hash of the prompt and text it was made from. Both are removed once the update
+    is applied.
+    """
+
+    def __init__(self, path: str, max_age: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_pages ("
+                "ocr_key TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL, saved_at REAL NOT NULL, "
+                "PRIMARY KEY (ocr_key, page))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS classifications ("
+                "doc_id INTEGER PRIMARY KEY, text_key TEXT NOT NULL, result TEXT NOT NULL, saved_at REAL NOT NULL)"
+            )
+            # Documents that were never finished, e.g. deleted in paperless
+            cutoff = time.time() - max_age
+            pruned = self._conn.execute("DELETE FROM ocr_pages WHERE saved_at < ?", (cutoff,)).rowcount
+            pruned += self._conn.execute("DELETE FROM classifications WHERE saved_at < ?", (cutoff,)).rowcount
+        if pruned:
+            logger.info(f"Removed {pruned} checkpoint(s) older than {max_age}s")
+
+    def ocr_pages(self, ocr_key: str) -> Dict[int, str]:
+        """Page number -> text of pages already OCR-ed."""
+        with self._lock:
+            rows = self._conn.execute("SELECT page, text FROM ocr_pages WHERE ocr_key = ?", (ocr_key,)).fetchall()
+        return dict(rows)
+
+    def save_page(self, ocr_key: str, page: int, text: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_pages (ocr_key, page, text, saved_at) VALUES (?, ?, ?, ?)",
+                (ocr_key, page, text, time.time())
+            )
+
+    def classification(self, doc_id: int, text_key: str) -> Optional[str]:
+        """Classification result (JSON) saved for the document, if it was made from the same prompt and text."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM classifications WHERE doc_id = ? AND text_key = ?", (doc_id, text_key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_classification(self, doc_id: int, text_key: str, result: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO classifications (doc_id, text_key, result, saved_at) VALUES (?, ?, ?, ?)",
+                (doc_id, text_key, result, time.time())
+            )
+
+    def clear(self, doc_id: int, ocr_key: Optional[str] = None):
+        """Forget the progress of a document whose update was applied."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM classifications WHERE doc_id = ?", (doc_id,))
+            if ocr_key:
+                self._conn.execute("DELETE FROM ocr_pages WHERE ocr_key = ?", (ocr_key,))
+
+
+def get_checkpoints() -> CheckpointStore:
+    """Checkpoint store shared by all workers."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CheckpointStore(sqlite_path("checkpoints.sqlite3"), settings.checkpoint_max_age)
+        return _store
@@ -6,21 +6,83 @@ class Settings(BaseSettings):
     paperless_token: str
     paperless_ai_tag: str = "ai-processed"
     
-    ollama_url: str
+    ollama_url: str  # several hosts can be given comma separated
     ollama_model: str
+    ollama_ocr_url: str | None = None  # hosts for vision OCR, defaults to ollama_url
+    ollama_ocr_model: str | None = None  # vision model for OCR, defaults to ollama_model
+    ollama_max_failures: int = 3  # consecutive failures before a host is ejected
+    ollama_eject_seconds: int = 60  # how long an ejected host is not used
+    ollama_health_interval: int = 30  # seconds between health checks of hosts (with several hosts)
     ollama_num_ctx: int | None = None
+    ollama_keep_alive: str = "30m"  # how long ollama keeps the model (and its prompt cache) loaded
+    ollama_warm_up: bool = True  # load the model and the prompt at startup
+    ollama_stream: bool = True  # stream classification responses, stop once the JSON is complete
+    ollama_first_token_timeout: float = 300  # seconds, includes model loading and prompt processing
+    ollama_token_timeout: float = 30  # seconds, maximum gap between streamed tokens
+    ollama_structured_output: bool = True  # constrain responses to the JSON schema of the result (ollama 0.5+)
+    json_repair_retries: int = 1  # times an invalid JSON response is sent back to the model to be fixed
     
     prompt_file: str = "prompt.txt"
+    prompt_chars_per_token: float = 3.0  # used to estimate prompt size, lower is more conservative
+    prompt_output_reserve: int = 512  # tokens of the context window kept free for the response
+    prompt_tail_fraction: float = 0.2  # share of a shortened OCR text taken from the end of the document
+    batch_classify_size: int = 0  # short documents classified in one request, 0 or 1 disables batching
+    batch_classify_max_chars: int = 500  # documents with at most this much text are batched
+    batch_classify_wait: float = 5.0  # seconds a short document waits for others to fill a batch
+    taxonomy_shortlist_k: int = 0  # inject only the k most similar tags/correspondents, 0 injects all
+    ollama_embed_model: str = "nomic-embed-text"
+    taxonomy_doc_chars: int = 2000  # characters of OCR text embedded to find similar names
+    taxonomy_embed_batch_size: int = 64
     log_level: str = "INFO"
     override_existing_tags: bool = True
+    fuzzy_match_threshold: float = 0.9  # similarity needed to reuse an existing correspondent, 1 only ignores case, accents and legal suffixes
     ocr_source: Literal["paperless", "llm"] = "paperless"
     llm_ocr_source_page_limit: int
+    ocr_parallel_pages: int | None = None  # pages OCR-ed at once, defaults to (and capped by) llm_concurrency per OCR host
+    ocr_page_retries: int = 3
+    ocr_retry_backoff: float = 2.0  # seconds, doubled on every retry
+    text_layer_min_chars: int = 100  # pages with this much embedded text skip vision OCR, 0 always uses vision OCR
+    pdf_dpi: int = 200  # resolution pages are rendered at for LLM OCR
+    pdf_grayscale: bool = False
+    pdf_max_edge: int = 0  # downscale pages to this longest side in pixels, 0 keeps the rendered size
+    pdf_image_format: Literal["png", "jpeg"] = "png"  # format pages are sent to the vision model in
+    pdf_jpeg_quality: int = 90
+    pdf_render_chunk: int = 2  # pages rendered per pdftoppm call, bounds memory use
+    preprocess_workers: int | None = None  # processes rendering and encoding pages, defaults to min(CPUs, 4)
 
-    scan_interval: int = 600  # seconds, default 10 minuts
+    scan_interval: int = 600  # seconds, longest wait between scans when idle, default 10 minuts
+    scan_min_interval: int = 60  # seconds, wait after a scan that queued documents, doubled while idle
+    webhook_scan_interval: int = 3600  # seconds between scans once webhooks arrive
+    scan_yield_gpu: bool = True  # don't queue documents while ollama is busy with other models
+    backlog_batch_size: int = 100  # documents queued per scan, the next scan follows immediately if there are more
+
+    data_dir: str = "data"  # local state (caches), mount it as a volume to survive restarts
+    metadata_cache_ttl: int = 86400  # seconds, full metadata reload after this time
+    metadata_refresh_interval: int = 60  # seconds, refreshes within this window are skipped
+    result_cache_max_entries: int = 5000  # cached OCR/classification results, 0 disables the cache
+    checkpoint_max_age: int = 604800  # seconds, progress of unfinished documents is kept this long
+
+    workers: int = 1  # documents processed in parallel
+    queue_max_attempts: int = 5  # failed documents are retried this many times
+    queue_retry_backoff: float = 60  # seconds, doubled on every retry
+    queue_failed_cooldown: int = 86400  # seconds before scans retry a document that exhausted its attempts
+    paperless_concurrency: int = 4  # max parallel requests to paperless
+    bulk_update_size: int = 0  # results of queue workers applied together with bulk edits, 0 or 1 disables it
+    bulk_update_wait: float = 5.0  # seconds a result waits for others to fill a bulk update
+    llm_concurrency: int = 1  # max parallel requests to ollama, match OLLAMA_NUM_PARALLEL of your server
+
+    http_connect_timeout: float = 10  # seconds
+    paperless_timeout: float = 60  # seconds, API calls
+    paperless_download_timeout: float = 300  # seconds, original PDF download
+    ollama_timeout: float = 120  # seconds, single generate call
+    http_retries: int = 3  # retries on connection errors and 429/5xx responses
+    http_retry_backoff: float = 1.0  # seconds, doubled on every retry
     
     webhook_host: str = "0.0.0.0"
     webhook_port: int = 8000
+    metrics_port: int | None = None  # auto mode only, webhook mode serves /metrics on the webhook port
     
-    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
+    # docker-compose passes unset variables as empty strings, which mean "use the default"
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", env_ignore_empty=True)
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,49 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src.config import settings
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class _Retry(Retry):
+    """Only idempotent requests are sent again after the server may have received them."""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if (error is not None and self._is_read_error(error)
+                and (method or "").upper() not in Retry.DEFAULT_ALLOWED_METHODS):
+            raise error.with_traceback(_stacktrace)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def build_session(pool_size: int, retry_reads: bool = True, hosts: int = 1) -> requests.Session:
+    """
+    Session with a keep-alive connection pool and a common retry policy.
+
+    Connection errors and 429/5xx responses are retried with exponential
+    backoff (honouring Retry-After), for every HTTP method. A request that was
+    sent but timed out or broke while waiting for the answer is only sent again
+    with retry_reads and an idempotent method (GET, PUT, DELETE, ...): a POST
+    creating a tag may have gone through, and for ollama it would queue the same
+    generation twice.
+    A pool of up to pool_size connections is kept for each of the hosts.
+    """
+    retry = _Retry(
+        total=settings.http_retries,
+        read=None if retry_reads else False,
+        backoff_factor=settings.http_retry_backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=max(hosts, 1), pool_maxsize=max(pool_size, 1), max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
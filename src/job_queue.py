@@ -0,0 +1,168 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from src.config import settings
+from src.utils import logger
+from src import metrics
+
+
+class JobQueue:
+    """
+    Persistent queue of documents waiting for processing, stored in SQLite.
+
+    There is at most one job per document: enqueueing a document that is already
+    pending is a no-op, and a document a webhook reports while it is being processed
+    is run once more afterwards instead of concurrently. Failed jobs are retried
+    with exponential backoff, jobs interrupted by a restart are picked up again.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._workers: List[threading.Thread] = []
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "doc_id INTEGER PRIMARY KEY, "
+                "status TEXT NOT NULL, "          # pending, running, failed
+                "source TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "rerun INTEGER NOT NULL DEFAULT 0, "
+                "enqueued_at REAL NOT NULL, "
+                "next_attempt_at REAL NOT NULL, "
+                "started_at REAL, "
+                "last_error TEXT)"
+            )
+            recovered = self._conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'").rowcount
+        if recovered:
+            logger.info(f"Requeued {recovered} job(s) interrupted by the last shutdown")
+        metrics.track_queue(self)
+
+    def enqueue(self, doc_id: int, source: str) -> bool:
+        """Add a document to the queue. Returns False if it was already queued."""
+        now = time.time()
+        with self._wakeup, self._conn:
+            row = self._conn.execute("SELECT status, next_attempt_at FROM jobs WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row and row[0] == "pending":
+                return False
+            if row and row[0] == "failed" and source == "scan" and now < row[1]:
+                # Scans retry documents that failed for good only after a cooldown
+                return False
+            if row and row[0] == "running":
+                # A webhook means the document changed; a scan only sees it is not marked processed yet
+                if source == "webhook":
+                    self._conn.execute("UPDATE jobs SET rerun = 1 WHERE doc_id = ?", (doc_id,))
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (doc_id, status, source, attempts, rerun, enqueued_at, next_attempt_at) "
+                "VALUES (?, 'pending', ?, 0, 0, ?, ?)",
+                (doc_id, source, now, now)
+            )
+            self._wakeup.notify()
+        return True
+
+    def claim(self) -> Optional[int]:
+        """Mark the oldest due job as running and return its document ID."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT doc_id FROM jobs WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY enqueued_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE doc_id = ?", (now, row[0])
+            )
+            return row[0]
+
+    def complete(self, doc_id: int):
+        with self._wakeup, self._conn:
+            rerun = self._conn.execute("SELECT rerun FROM jobs WHERE doc_id = ?", (doc_id,)).fetchone()
+            if rerun and rerun[0]:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'pending', rerun = 0, attempts = 0, next_attempt_at = ? WHERE doc_id = ?",
+                    (time.time(), doc_id)
+                )
+            else:
+                self._conn.execute("DELETE FROM jobs WHERE doc_id = ?", (doc_id,))
+            self._wakeup.notify_all()
+
+    def fail(self, doc_id: int, error: str):
+        with self._wakeup, self._conn:
+            attempts = self._conn.execute("SELECT attempts FROM jobs WHERE doc_id = ?", (doc_id,)).fetchone()[0] + 1
+            if attempts >= settings.queue_max_attempts:
+                logger.error(f"Giving up on document {doc_id} after {attempts} attempts")
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', attempts = ?, rerun = 0, last_error = ?, next_attempt_at = ? "
+                    "WHERE doc_id = ?",
+                    (attempts, error, time.time() + settings.queue_failed_cooldown, doc_id)
+                )
+                self._wakeup.notify_all()
+                return
+            delay = settings.queue_retry_backoff * 2 ** (attempts - 1)
+            logger.warning(f"Document {doc_id} failed (attempt {attempts}), retrying in {delay:.0f}s")
+            self._conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = ?, rerun = 0, last_error = ?, next_attempt_at = ? "
+                "WHERE doc_id = ?",
+                (attempts, error, time.time() + delay, doc_id)
+            )
+            self._wakeup.notify_all()
+
+    def wait_until_below(self, depth: int):
+        """Block until fewer than depth jobs are due for processing."""
+        with self._wakeup:
+            while self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND next_attempt_at <= ?", (time.time(),)
+            ).fetchone()[0] >= depth:
+                self._wakeup.wait(timeout=5)
+
+    def stats(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest_pending = self._conn.execute("SELECT MIN(enqueued_at) FROM jobs WHERE status = 'pending'").fetchone()[0]
+            oldest_running = self._conn.execute("SELECT MIN(started_at) FROM jobs WHERE status = 'running'").fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_pending_age": round(now - oldest_pending, 1) if oldest_pending else None,
+            "oldest_running_age": round(now - oldest_running, 1) if oldest_running else None,
+        }
+
+    def workers_alive(self) -> int:
+        """Number of running worker threads, without touching the database."""
+        return sum(worker.is_alive() for worker in self._workers)
+
+    def start_workers(self, handler: Callable[[int], bool], concurrency: int):
+        """Start worker threads calling handler(doc_id); a False return or an exception counts as failure."""
+        for i in range(concurrency):
+            worker = threading.Thread(target=self._worker, args=(handler,), name=f"worker-{i + 1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {concurrency} queue worker(s)")
+
+    def _worker(self, handler: Callable[[int], bool]):
+        while True:
+            doc_id = self.claim()
+            if doc_id is None:
+                with self._wakeup:
+                    # Also wake up periodically for jobs whose retry delay has passed
+                    self._wakeup.wait(timeout=5)
+                continue
+            try:
+                ok = handler(doc_id)
+                error = "processing failed"
+            except Exception as e:
+                ok = False
+                error = str(e)
+            if ok:
+                self.complete(doc_id)
+            else:
+                self.fail(doc_id, error)
@@ -1,98 +1,448 @@
 import requests
 import json
-import base64
-import io
-from typing import List
-from PIL import Image
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Tuple, TypeVar
+import numpy as np
+from pydantic import ValidationError
 from src.config import settings
-from src.utils import logger, extract_json_from_text
+from src.ollama_router import OllamaRouter
+from src.utils import logger, extract_json_from_text, JsonObjectScanner, data_dir_writable
 from src.models import LLMResponse
+from src.result_cache import ResultCache
+from src.prompt_builder import fit_ocr_text
+from src.taxonomy_index import TaxonomyIndex
+from src.batch_classifier import BatchClassifier
+from src.preprocess import image_options
+from src import metrics
+
+T = TypeVar("T")
+
+OCR_PROMPT = "Extract all text from this image. Return only the text content without any additional commentary."
+BATCH_INSTRUCTIONS = """
+
+You will receive several documents, each starting with a line "### Document <id>".
+Analyze every document separately as described above. Return ONLY one JSON object
+whose keys are the document ids and whose values are the JSON objects described above."""
+REPAIR_PROMPT = """The text below should be a JSON object, but it could not be used: {error}
+Return ONLY the corrected JSON object, keeping all keys and values."""
 
 class OllamaClient:
     def __init__(self):
-        self.base_url = settings.ollama_url
         self.model = settings.ollama_model
+        self.ocr_model = settings.ollama_ocr_model or settings.ollama_model
+        # Shared by all worker threads, limits parallel requests per ollama host
+        self.router = OllamaRouter(settings.ollama_url)
+        self.ocr_router = OllamaRouter(settings.ollama_ocr_url) if settings.ollama_ocr_url else self.router
+        self.cache = None
+        if settings.result_cache_max_entries and data_dir_writable():
+            self.cache = ResultCache(os.path.join(settings.data_dir, "results.sqlite3"), settings.result_cache_max_entries)
+        self.taxonomy = TaxonomyIndex(self) if settings.taxonomy_shortlist_k else None
+        self.batcher = BatchClassifier(self) if settings.batch_classify_size > 1 else None
+        # Every key is required (null is allowed), so a constrained model can't skip any
+        self.schema = LLMResponse.model_json_schema()
+        self.schema["required"] = list(self.schema["properties"])
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embedding vectors of texts, one row per text."""
+        response = self.router.post(
+            "/api/embed",
+            {"model": settings.ollama_embed_model, "input": texts, "keep_alive": settings.ollama_keep_alive}
+        )
+        response.raise_for_status()
+        return np.array(response.json()["embeddings"], dtype=np.float32)
 
     def process_document(self, prompt: str, ocr_text: str) -> LLMResponse:
-        full_prompt = f"{prompt}\n\n{ocr_text[:64000]}" # Truncate to avoid context limits if necessary
+        # Shorten the OCR text so the prompt fits into the context window
+        ocr_text, _ = fit_ocr_text(prompt, ocr_text)
+
+        cache_key = self.classification_key(prompt, ocr_text)
+        if self.cache and (cached := self.cache.get(cache_key, "classification")):
+            return LLMResponse.model_validate_json(cached)
 
-        logger.debug(f"Sending prompt to Ollama:\n{full_prompt[:1000]}")
+        logger.debug(f"Sending prompt to Ollama:\n{prompt[:1000]}")
         
         try:
+            # Instructions and metadata lists go first as the system prompt, which is the same
+            # for consecutive documents, so ollama can reuse its cache instead of recomputing it
             payload = {
                 "model": self.model,
-                "prompt": full_prompt,
+                "system": prompt,
+                "prompt": ocr_text,
                 "stream": False,
-                "format": "json"
+                "format": self._format(self.schema),
+                "keep_alive": settings.ollama_keep_alive
             }
             if settings.ollama_num_ctx:
                 payload["options"] = {"num_ctx": settings.ollama_num_ctx}
 
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=120
-            )
-            response.raise_for_status()
-            result_text = response.json().get("response", "")
+            result_text, stats = self._generate(payload, stop_at_json=True)
+            metrics.record_generation(stats)
             
-            logger.info("Received response from Ollama")
+            logger.info(f"Received response from Ollama ({_format_stats(stats)})")
             logger.debug(f"Raw Response: {result_text}")
 
-            data = extract_json_from_text(result_text)
-            return LLMResponse(**data)
+            result = self._parse_response("classification", result_text, LLMResponse.model_validate, self.schema)
+            if self.cache:
+                self.cache.put(cache_key, "classification", result.model_dump_json())
+            return result
 
         except Exception as e:
             logger.error(f"Ollama API Error: {str(e)}")
             raise
 
-    def perform_ocr(self, images: list[Image.Image]) -> str:
+    def classification_key(self, prompt: str, ocr_text: str) -> str:
+        """Result cache key of a classification."""
+        return ResultCache.make_key("classify", self.model, settings.ollama_num_ctx, prompt, ocr_text)
+
+    def classify_batch(self, prompt: str, documents: List[Tuple[int, str]]) -> Dict[int, LLMResponse]:
+        """
+        Classify several short documents with one request, sharing the prompt.
+
+        Returns:
+            Document ID -> result, for the documents the model returned a valid result for
+        """
+        schema = {
+            "type": "object",
+            "properties": {str(doc_id): self.schema for doc_id, _ in documents},
+            "required": [str(doc_id) for doc_id, _ in documents],
+        }
+        payload = {
+            "model": self.model,
+            "system": prompt + BATCH_INSTRUCTIONS,
+            "prompt": "\n\n".join(f"### Document {doc_id}\n{text}" for doc_id, text in documents),
+            "stream": False,
+            "format": self._format(schema),
+            "keep_alive": settings.ollama_keep_alive
+        }
+        if settings.ollama_num_ctx:
+            payload["options"] = {"num_ctx": settings.ollama_num_ctx}
+
+        result_text, stats = self._generate(payload, stop_at_json=True)
+        metrics.record_generation(stats)
+        logger.info(f"Received batch response for {len(documents)} documents ({_format_stats(stats)})")
+        logger.debug(f"Raw Response: {result_text}")
+
+        data = self._parse_response("batch", result_text, _require_object, schema)
+        results = {}
+        for doc_id, text in documents:
+            entry = data.get(str(doc_id))
+            if not isinstance(entry, dict):
+                continue
+            try:
+                results[doc_id] = LLMResponse(**entry)
+            except ValidationError as e:
+                logger.warning(f"Invalid batch result for document {doc_id}: {e}")
+                continue
+            if self.cache:
+                self.cache.put(self.classification_key(prompt, text), "classification", results[doc_id].model_dump_json())
+        return results
+
+    def _format(self, schema: dict) -> dict | str:
+        """Value of the "format" request field: the JSON schema, or any JSON on older ollama versions."""
+        return schema if settings.ollama_structured_output else "json"
+
+    def _parse_response(self, request: str, result_text: str, parse: Callable[[object], T], schema: dict) -> T:
+        """
+        Extract the JSON from a response and parse it with parse().
+
+        An invalid response is sent back to the model together with the error, up to
+        JSON_REPAIR_RETRIES times. Repairing only reprocesses the response, not the
+        document and the prompt.
+        """
+        for attempt in range(settings.json_repair_retries + 1):
+            try:
+                try:
+                    data, how = json.loads(result_text), "ok"
+                except json.JSONDecodeError:
+                    data, how = extract_json_from_text(result_text), "extracted"
+                result = parse(data)
+                metrics.JSON_RESPONSES.labels(request, "repaired" if attempt else how).inc()
+                return result
+            except ValueError as e:  # includes JSONDecodeError and ValidationError
+                error = e
+            if attempt < settings.json_repair_retries:
+                logger.warning(f"Invalid JSON in {request} response, asking the model to repair it: {error}")
+                result_text = self._repair_json(result_text, error, schema)
+
+        metrics.JSON_RESPONSES.labels(request, "failed").inc()
+        raise ValueError(f"No valid JSON in {request} response after {settings.json_repair_retries} repair attempt(s): {error}")
+
+    def _repair_json(self, result_text: str, error: Exception, schema: dict) -> str:
+        payload = {
+            "model": self.model,
+            "system": REPAIR_PROMPT.format(error=error),
+            "prompt": result_text,
+            "stream": False,
+            "format": self._format(schema),
+            "keep_alive": settings.ollama_keep_alive
+        }
+        if settings.ollama_num_ctx:
+            payload["options"] = {"num_ctx": settings.ollama_num_ctx}
+        result_text, stats = self._generate(payload, stop_at_json=True)
+        metrics.record_generation(stats)
+        logger.debug(f"Repaired response: {result_text}")
+        return result_text
+
+    def warm_up(self, prompt: str | None = None):
+        """
+        Load the models on every host before the first document arrives. With a prompt,
+        it is also evaluated once as system prompt, so the first document finds it in
+        ollama's cache.
+        """
+        targets = [(self.router, self.model, prompt)]
+        if settings.ocr_source == "llm" and (self.ocr_router is not self.router or self.ocr_model != self.model):
+            targets.append((self.ocr_router, self.ocr_model, None))
+
+        for router, model, system in targets:
+            payload = {"model": model, "keep_alive": settings.ollama_keep_alive, "stream": False}
+            options = {"num_ctx": settings.ollama_num_ctx} if settings.ollama_num_ctx else {}
+            if system:
+                payload.update(system=system, prompt=".")
+                options["num_predict"] = 1
+            if options:
+                payload["options"] = options
+
+            for backend in router.backends:
+                logger.info(f"Warming up model {model} on {backend.url}...")
+                started = time.monotonic()
+                try:
+                    response = router.post_to(backend, "/api/generate", payload, timeout=settings.ollama_first_token_timeout)
+                    response.raise_for_status()
+                except requests.RequestException as e:
+                    logger.warning(f"Warm-up of {model} on {backend.url} failed: {e}")
+                    continue
+                logger.info(f"Model {model} ready on {backend.url} after {time.monotonic() - started:.1f}s")
+
+    def gpu_busy(self) -> bool:
+        """
+        True if every classification host has other models loaded but not ours (/api/ps),
+        i.e. someone else is using the GPUs and our requests would only make ollama swap models.
+        Unreachable hosts don't count as busy, failures are handled by the router.
+        """
+        model = self.model if ":" in self.model else f"{self.model}:latest"
+        for backend in self.router.backends:
+            try:
+                response = self.router.session.get(f"{backend.url}/api/ps", timeout=settings.http_connect_timeout)
+                response.raise_for_status()
+            except requests.RequestException:
+                return False
+            loaded = {m.get("name") or m.get("model") for m in response.json().get("models", [])}
+            if not loaded or model in loaded:
+                return False
+        return True
+
+    def _generate(self, payload: dict, stop_at_json: bool = False) -> tuple[str, dict]:
+        """
+        Call /api/generate and return the response text and generation stats.
+
+        With OLLAMA_STREAM enabled the response is read as it is generated: the wait
+        for the first token and the gaps between tokens have separate timeouts, and
+        with stop_at_json reading stops as soon as the first JSON object is complete,
+        which also makes ollama stop generating.
+        """
+        if not settings.ollama_stream:
+            response = self.router.post("/api/generate", {**payload, "stream": False})
+            response.raise_for_status()
+            data = response.json()
+            return data.get("response", ""), _generation_stats(data)
+
+        scanner = JsonObjectScanner()
+        parts = []
+        chunks = 0
+        final = {}
+        first_token_at = None
+        with self.router.acquire() as backend:
+            started = time.monotonic()
+            response = None
+            try:
+                # Ollama answers once the model is loaded and the prompt processed
+                response = self.router.post_to(
+                    backend,
+                    "/api/generate",
+                    {**payload, "stream": True},
+                    timeout=settings.ollama_first_token_timeout,
+                    stream=True
+                )
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if "error" in chunk:
+                        raise RuntimeError(chunk["error"])
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                        _set_read_timeout(response, settings.ollama_token_timeout)
+                    text = chunk.get("response", "")
+                    parts.append(text)
+                    chunks += 1
+                    if chunk.get("done"):
+                        final = chunk
+                        break
+                    if stop_at_json and scanner.feed(text):
+                        logger.debug("JSON object complete, stopping generation")
+                        break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if response is None and not isinstance(e, requests.exceptions.ReadTimeout):
+                    raise  # host unreachable
+                if first_token_at is None:
+                    raise TimeoutError(f"No response from Ollama within {settings.ollama_first_token_timeout}s") from e
+                raise TimeoutError(f"Ollama stalled for more than {settings.ollama_token_timeout}s between tokens") from e
+            finally:
+                if response is not None:
+                    response.close()
+
+        result_text = "".join(parts)
+        if scanner.end is not None:
+            result_text = result_text[scanner.start:scanner.end]
+
+        stats = _generation_stats(final)
+        stats["time_to_first_token"] = first_token_at - started if first_token_at else None
+        if not final and first_token_at:
+            # Stopped early, estimate from the streamed chunks (one token each)
+            stats["eval_count"] = chunks
+            stats["tokens_per_second"] = chunks / max(time.monotonic() - first_token_at, 1e-6)
+        return result_text, stats
+
+    def ocr_cache_key(self, pdf_bytes: bytes) -> str:
+        """Cache key for the OCR text of a PDF rendered and OCR-ed with the current settings."""
+        return ResultCache.make_key(
+            "ocr", self.ocr_model, settings.ollama_num_ctx, OCR_PROMPT,
+            json.dumps(image_options(), sort_keys=True), settings.text_layer_min_chars, pdf_bytes
+        )
+
+    def perform_ocr(self, images: Iterable[str], page_count: int | None = None, cache_key: str | None = None,
+                    page_texts: List[str | None] | None = None,
+                    on_page: Callable[[int, str], None] | None = None) -> str:
         """
         Perform OCR on images with LLM vision.
+
+        Pages are sent to ollama concurrently (OCR_PARALLEL_PAGES, bounded by
+        LLM_CONCURRENCY per OCR host). Images are consumed lazily, only pages in flight are
+        held in memory. Text is reassembled in page order.
         
         Args:
-            images: list of PIL images
+            images: base64 encoded page images, a list or a generator (see preprocess.iter_page_images)
+            page_count: number of pages, only used for logging
+            cache_key: see ocr_cache_key(); on a cache hit the images are not consumed at all
+            page_texts: text already known per page (see preprocess.text_layer_pages); images
+                are then only expected for the pages that are None
+            on_page: called with page number and text as soon as a page is OCR-ed
             
         Returns:
             The OCR text extracted from the document
+
+        Raises:
+            RuntimeError: if a page still fails after all retries
         """
+        if self.cache and cache_key and (cached := self.cache.get(cache_key, "ocr")) is not None:
+            return cached
 
-        ocr_text_parts = []
-        
-        for i, image in enumerate(images):
-            logger.info(f"Processing page {i+1}/{len(images)}...")
-            
-            # Convert image to base64
-            buffered = io.BytesIO()
-            image.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
-            # Send to Ollama for OCR
-            try:
-                payload = {
-                    "model": self.model,
-                    "prompt": "Extract all text from this image. Return only the text content without any additional commentary.",
-                    "images": [img_base64],
-                    "stream": False
-                }
-                if settings.ollama_num_ctx:
-                    payload["options"] = {"num_ctx": settings.ollama_num_ctx}
-
-                response = requests.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload,
-                    timeout=120
-                )
-                response.raise_for_status()
-                page_text = response.json().get("response", "")
-                ocr_text_parts.append(page_text)
-                logger.debug(f"Extracted {len(page_text)} characters from page {i+1}")
-                
-            except Exception as e:
-                logger.error(f"Error processing page {i+1} with Ollama: {str(e)}")
-                ocr_text_parts.append(f"[OCR Error on page {i+1}]")
+        capacity = self.ocr_router.capacity
+        max_in_flight = min(settings.ocr_parallel_pages or capacity, capacity)
+        pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="ocr")
+        # Page numbers the images belong to
+        ocr_pages = (page for page, text in enumerate(page_texts, start=1) if text is None) if page_texts else None
+        futures: list[Future] = []
+        try:
+            for page, img_base64 in enumerate(images, start=1):
+                if ocr_pages is not None:
+                    page = next(ocr_pages)
+                futures.append(pool.submit(self._ocr_page, img_base64, page, page_count, on_page))
+                # Don't render further ahead than one page per free slot
+                pending = [f for f in futures if not f.done()]
+                if len(pending) > max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()  # stop rendering as soon as a page failed for good
+            ocr_text_parts = [future.result() for future in futures]
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+        if page_texts:
+            ocr_results = iter(ocr_text_parts)
+            ocr_text_parts = [text if text is not None else next(ocr_results) for text in page_texts]
         
         full_ocr_text = "\n\n".join(ocr_text_parts)
         logger.info(f"OCR complete. Total text length: {len(full_ocr_text)} characters")
         logger.debug(f"OCR text:\n{full_ocr_text}")
+        if self.cache and cache_key:
+            self.cache.put(cache_key, "ocr", full_ocr_text)
         return full_ocr_text
+
+    def _ocr_page(self, img_base64: str, page: int, total: int | None,
+                  on_page: Callable[[int, str], None] | None = None) -> str:
+        payload = {
+            "model": self.ocr_model,
+            "prompt": OCR_PROMPT,
+            "images": [img_base64],
+            "stream": False,
+            "keep_alive": settings.ollama_keep_alive
+        }
+        if settings.ollama_num_ctx:
+            payload["options"] = {"num_ctx": settings.ollama_num_ctx}
+
+        for attempt in range(settings.ocr_page_retries + 1):
+            logger.info(f"Processing page {page}/{total or '?'}...")
+            try:
+                with metrics.time_stage("ocr_page"):
+                    response = self.ocr_router.post("/api/generate", payload)
+                    response.raise_for_status()
+                data = response.json()
+                metrics.record_generation(_generation_stats(data))
+                page_text = data.get("response", "")
+                logger.debug(f"Extracted {len(page_text)} characters from page {page}")
+                break
+            except Exception as e:
+                if attempt == settings.ocr_page_retries:
+                    raise RuntimeError(f"OCR failed on page {page} after {attempt + 1} attempts: {e}") from e
+                delay = settings.ocr_retry_backoff * 2 ** attempt
+                logger.warning(f"Error processing page {page} with Ollama: {str(e)}. Retrying in {delay:.0f}s")
+                time.sleep(delay)
+
+        if on_page:
+            on_page(page, page_text)
+        return page_text
+
+
+def _require_object(data) -> dict:
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    return data
+
+
+def _generation_stats(data: dict) -> dict:
+    """Token counts and speed from the final /api/generate response (durations are in ns)."""
+    stats = {
+        "prompt_eval_count": data.get("prompt_eval_count"),
+        "prompt_eval_seconds": data["prompt_eval_duration"] / 1e9 if data.get("prompt_eval_duration") else None,
+        "eval_count": data.get("eval_count"),
+        "eval_seconds": data["eval_duration"] / 1e9 if data.get("eval_duration") else None,
+        "tokens_per_second": None,
+    }
+    if stats["eval_count"] and stats["eval_seconds"]:
+        stats["tokens_per_second"] = stats["eval_count"] / stats["eval_seconds"]
+    return stats
+
+
+def _format_stats(stats: dict) -> str:
+    parts = []
+    if stats.get("prompt_eval_count"):
+        parts.append(f"{stats['prompt_eval_count']} prompt tokens")
+    if stats.get("eval_count"):
+        parts.append(f"{stats['eval_count']} tokens")
+    if stats.get("tokens_per_second"):
+        parts.append(f"{stats['tokens_per_second']:.1f} tokens/s")
+    if stats.get("time_to_first_token"):
+        parts.append(f"first token after {stats['time_to_first_token']:.1f}s")
+    return ", ".join(parts) or "no stats"
+
+
+def _set_read_timeout(response: requests.Response, timeout: float):
+    """Change the socket read timeout of a streaming response once generation has started."""
+    connection = getattr(response.raw, "connection", None) or getattr(response.raw, "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        sock.settimeout(timeout)
@@ -0,0 +1,69 @@
+import json
+import os
+import time
+from typing import Dict
+from src.utils import logger, data_dir_writable
+
+ENDPOINTS = ("tags", "correspondents", "document_types")
+
+
+class MetadataCache:
+    """
+    On-disk snapshot of Paperless metadata (ID -> name for every endpoint),
+    so a restart does not have to walk every page of tags and correspondents again.
+    """
+
+    def __init__(self, path: str, base_url: str):
+        self.path = path
+        self.base_url = base_url
+        self.items: Dict[str, Dict[int, str]] = {endpoint: {} for endpoint in ENDPOINTS}
+        self.processed_cf_id: int = 0
+        self.full_sync_at: float = 0.0
+        self.loaded = False
+
+    def load(self) -> bool:
+        """Load the snapshot from disk. Returns True if a usable snapshot was found."""
+        if self.loaded:
+            return True
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable metadata cache {self.path}: {e}")
+            return False
+
+        if data.get("base_url") != self.base_url:
+            logger.info("Metadata cache belongs to a different Paperless instance, ignoring it")
+            return False
+
+        for endpoint in ENDPOINTS:
+            self.items[endpoint] = {int(k): v for k, v in data.get("items", {}).get(endpoint, {}).items()}
+        self.processed_cf_id = data.get("processed_cf_id", 0)
+        self.full_sync_at = data.get("full_sync_at", 0.0)
+        self.loaded = True
+        return True
+
+    def save(self):
+        if not data_dir_writable():
+            return
+        data = {
+            "base_url": self.base_url,
+            "full_sync_at": self.full_sync_at,
+            "saved_at": time.time(),
+            "processed_cf_id": self.processed_cf_id,
+            "items": self.items,
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write metadata cache {self.path}: {e}")
+
+    def name_map(self, endpoint: str) -> Dict[str, int]:
+        """Lowercase name -> ID mapping, as used for matching LLM output."""
+        return {name.lower(): id_ for id_, name in self.items[endpoint].items()}
@@ -0,0 +1,69 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+STAGE_SECONDS = Histogram(
+    "paperllama_stage_duration_seconds", "Duration of processing stages", ["stage"], buckets=STAGE_BUCKETS
+)
+OLLAMA_TOKENS = Counter(
+    "paperllama_ollama_tokens_total", "Tokens processed by ollama, prompt or generated (eval)", ["kind"]
+)
+OLLAMA_SECONDS = Histogram(
+    "paperllama_ollama_duration_seconds", "Ollama prompt processing (prompt) and generation (eval) time",
+    ["kind"], buckets=STAGE_BUCKETS
+)
+PROMPT_TOKENS = Histogram(
+    "paperllama_prompt_tokens", "Estimated prompt tokens per classification request", ["part"],
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+)
+PROMPT_TRUNCATIONS = Counter("paperllama_prompt_truncations_total", "OCR texts shortened to fit the context window")
+QUEUE_JOBS = Gauge("paperllama_queue_jobs", "Jobs in the processing queue", ["status"])
+QUEUE_OLDEST_PENDING = Gauge("paperllama_queue_oldest_pending_seconds", "Age of the oldest pending job")
+OLLAMA_BACKEND_UP = Gauge("paperllama_ollama_backend_up", "Whether an ollama host is in use (1) or ejected (0)", ["url"])
+OLLAMA_IN_FLIGHT = Gauge("paperllama_ollama_in_flight", "Requests running on an ollama host", ["url"])
+CACHE_REQUESTS = Counter("paperllama_cache_requests_total", "Cache lookups", ["cache", "result"])
+BATCH_DOCUMENTS = Counter(
+    "paperllama_batch_documents_total", "Short documents classified in a batch request or, as fallback, alone", ["result"]
+)
+JSON_RESPONSES = Counter(
+    "paperllama_json_responses_total",
+    "Model responses by how their JSON was parsed (ok, extracted from surrounding text, repaired, failed)",
+    ["request", "result"]
+)
+DOCUMENTS = Counter("paperllama_documents_total", "Processed documents", ["result"])
+PAGES = Counter("paperllama_pages_total", "Pages by where their text came from (text_layer, vision)", ["source"])
+ERRORS = Counter("paperllama_errors_total", "Errors by stage and exception type", ["stage", "type"])
+
+
+@contextmanager
+def time_stage(stage: str):
+    """Observe the duration of a block; exceptions are counted as errors of the stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERRORS.labels(stage, type(e).__name__).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def record_generation(stats: dict):
+    """Record token counts and durations reported by /api/generate."""
+    for kind, count_key, seconds_key in (
+        ("prompt", "prompt_eval_count", "prompt_eval_seconds"),
+        ("eval", "eval_count", "eval_seconds"),
+    ):
+        if stats.get(count_key):
+            OLLAMA_TOKENS.labels(kind).inc(stats[count_key])
+        if stats.get(seconds_key):
+            OLLAMA_SECONDS.labels(kind).observe(stats[seconds_key])
+
+
+def track_queue(queue):
+    """Export queue depth, read from the queue whenever metrics are scraped."""
+    for status in ("pending", "running", "failed"):
+        QUEUE_JOBS.labels(status).set_function(lambda status=status: queue.stats()[status])
+    QUEUE_OLDEST_PENDING.set_function(lambda: queue.stats()["oldest_pending_age"] or 0)
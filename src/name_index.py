@@ -0,0 +1,88 @@
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, Optional, Tuple
+
+# Legal form suffixes as word sequences (after punctuation is removed, "d.o.o." is "d o o")
+LEGAL_SUFFIXES = [
+    s.split() for s in (
+        "d o o", "d d", "s p", "k d", "d n o", "z o o", "sp z o o", "s r o", "a s",
+        "gmbh", "mbh", "ag", "kg", "ug", "e v",
+        "ltd", "limited", "plc", "llc", "llp", "inc", "corp", "corporation", "co", "company",
+        "sa", "sas", "sarl", "srl", "spa", "bv", "nv", "oy", "ab",
+    )
+]
+CANDIDATES = 20
+
+
+def normalize_name(name: str) -> str:
+    """Fold diacritics, case and punctuation and strip legal form suffixes."""
+    text = unicodedata.normalize("NFKD", name)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    words = re.findall(r"\w+", text)
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in LEGAL_SUFFIXES:
+            if len(words) > len(suffix) and words[-len(suffix):] == suffix:
+                words = words[:-len(suffix)]
+                stripped = True
+    return " ".join(words)
+
+
+def _numbers(text: str) -> Counter:
+    return Counter(re.findall(r"\d+", text))
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Lookup of existing paperless names that tolerates spelling variants of LLM
+    output: normalized exact matches first, then trigram candidates ranked by
+    similarity ratio. Numbers must match exactly, "Invoice 2024" is not a
+    variant of "Invoice 2023".
+    """
+
+    def __init__(self, mapping: Dict[str, int]):
+        self._by_norm: Dict[str, Tuple[str, int]] = {}
+        self._trigram_index: Dict[str, set] = {}
+        for name, id_ in mapping.items():
+            self.add(name, id_)
+
+    def add(self, name: str, id_: int):
+        norm = normalize_name(name)
+        if not norm or norm in self._by_norm:
+            return
+        self._by_norm[norm] = (name, id_)
+        for gram in _trigrams(norm):
+            self._trigram_index.setdefault(gram, set()).add(norm)
+
+    def find(self, name: str, threshold: float) -> Optional[Tuple[str, int]]:
+        """Best matching (name, ID) with similarity >= threshold, or None."""
+        norm = normalize_name(name)
+        if not norm:
+            return None
+        if norm in self._by_norm:
+            return self._by_norm[norm]
+        if threshold >= 1:
+            return None
+
+        grams = _trigrams(norm)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigram_index.get(gram, ()))
+
+        numbers = _numbers(norm)
+        best, best_score = None, threshold
+        for candidate, _ in shared.most_common(CANDIDATES):
+            if _numbers(candidate) != numbers:
+                continue
+            score = SequenceMatcher(None, norm, candidate).ratio()
+            if score >= best_score:
+                best, best_score = candidate, score
+        return self._by_norm[best] if best else None
@@ -0,0 +1,132 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+import requests
+from src.config import settings
+from src.http_session import build_session
+from src.utils import logger
+from src import metrics
+
+# Weight of the latest request in the moving average of request durations
+LATENCY_ALPHA = 0.3
+
+
+class OllamaBackend:
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.latency = 1.0  # seconds, moving average of request durations
+        self.failures = 0  # consecutive
+        self.ejected_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+
+class OllamaRouter:
+    """
+    Spreads requests over one or more ollama hosts.
+
+    Every host gets LLM_CONCURRENCY slots. A request goes to the healthy host with
+    a free slot and the lowest (in flight + 1) * average request duration, so faster
+    GPUs get more work. A host failing OLLAMA_MAX_FAILURES times in a row is ejected
+    for OLLAMA_EJECT_SECONDS; a background health check takes it back as soon as it
+    answers again.
+    """
+
+    def __init__(self, urls: str):
+        self.backends = [OllamaBackend(url.strip().rstrip('/')) for url in urls.split(",") if url.strip()]
+        if not self.backends:
+            raise ValueError("No ollama URL configured")
+        self.capacity = settings.llm_concurrency * len(self.backends)
+        # Failed generations are retried per page and per job, not by the session
+        self.session = build_session(self.capacity, retry_reads=False, hosts=len(self.backends))
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        for backend in self.backends:
+            metrics.OLLAMA_BACKEND_UP.labels(backend.url).set(1)
+        if len(self.backends) > 1:
+            threading.Thread(target=self._health_loop, name="ollama-health", daemon=True).start()
+
+    @contextmanager
+    def acquire(self) -> Iterator[OllamaBackend]:
+        """Wait for a slot on the best host; an exception inside the block counts as a failure of the host."""
+        backend = self._take()
+        started = time.monotonic()
+        ok = False
+        try:
+            yield backend
+            ok = True
+        finally:
+            self._release(backend, time.monotonic() - started, ok)
+
+    def post(self, path: str, payload: dict, timeout: float | None = None) -> requests.Response:
+        with self.acquire() as backend:
+            response = self.post_to(backend, path, payload, timeout)
+            if response.status_code >= 500:
+                raise requests.HTTPError(f"{response.status_code} from {backend.url}", response=response)
+            return response
+
+    def post_to(self, backend: OllamaBackend, path: str, payload: dict, timeout: float | None = None, **kwargs) -> requests.Response:
+        """POST to a specific host, without taking a slot (see acquire)."""
+        return self.session.post(
+            f"{backend.url}{path}",
+            json=payload,
+            timeout=(settings.http_connect_timeout, timeout or settings.ollama_timeout),
+            **kwargs
+        )
+
+    def _take(self) -> OllamaBackend:
+        with self._released:
+            while True:
+                now = time.monotonic()
+                healthy = [b for b in self.backends if b.healthy(now)]
+                # With every host ejected, keep trying all of them rather than failing everything;
+                # hosts with fewer consecutive failures first
+                candidates = [b for b in healthy or self.backends if b.in_flight < settings.llm_concurrency]
+                if candidates:
+                    backend = min(candidates, key=lambda b: (b.failures, (b.in_flight + 1) * b.latency))
+                    backend.in_flight += 1
+                    metrics.OLLAMA_IN_FLIGHT.labels(backend.url).set(backend.in_flight)
+                    return backend
+                self._released.wait()
+
+    def _release(self, backend: OllamaBackend, seconds: float, ok: bool):
+        with self._released:
+            backend.in_flight -= 1
+            metrics.OLLAMA_IN_FLIGHT.labels(backend.url).set(backend.in_flight)
+            if ok:
+                backend.failures = 0
+                backend.latency += LATENCY_ALPHA * (seconds - backend.latency)
+            else:
+                backend.failures += 1
+                if backend.failures >= settings.ollama_max_failures and backend.healthy(time.monotonic()):
+                    self._eject(backend)
+            self._released.notify_all()
+
+    def _eject(self, backend: OllamaBackend):
+        backend.ejected_until = time.monotonic() + settings.ollama_eject_seconds
+        metrics.OLLAMA_BACKEND_UP.labels(backend.url).set(0)
+        logger.warning(f"Ollama host {backend.url} failed {backend.failures} times in a row, "
+                       f"not using it for {settings.ollama_eject_seconds}s")
+
+    def _health_loop(self):
+        while True:
+            time.sleep(settings.ollama_health_interval)
+            for backend in self.backends:
+                try:
+                    self.session.get(f"{backend.url}/api/version", timeout=settings.http_connect_timeout).raise_for_status()
+                    up = True
+                except requests.RequestException:
+                    up = False
+                with self._released:
+                    if up and not backend.healthy(time.monotonic()):
+                        logger.info(f"Ollama host {backend.url} is back")
+                        backend.ejected_until = 0.0
+                        backend.failures = 0
+                        metrics.OLLAMA_BACKEND_UP.labels(backend.url).set(1)
+                        self._released.notify_all()
+                    elif not up and backend.healthy(time.monotonic()):
+                        backend.failures = max(backend.failures, settings.ollama_max_failures)
+                        self._eject(backend)
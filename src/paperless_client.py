@@ -1,10 +1,19 @@
 import requests
-from typing import List, Optional, Dict, Any
+import os
+import threading
+import time
+from typing import Iterator, List, Optional, Dict, Any
 from src.config import settings
 from src.models import PaperlessDocument
+from src.metadata_cache import MetadataCache, ENDPOINTS
+from src.http_session import build_session
+from src.name_index import NameIndex
 from src.utils import logger
+from src import metrics
 import json
 
+ENTITY_LABELS = {"tags": "tag", "correspondents": "correspondent", "document_types": "document type"}
+
 class PaperlessClient:
     def __init__(self):
         self.base_url = settings.paperless_url.rstrip('/')
@@ -17,33 +26,129 @@ class PaperlessClient:
         self._correspondents_map: Dict[str, int] = {}
         self._types_map: Dict[str, int] = {}
         self._processed_cf_id: int = 0
-        
+        self._name_indexes: Dict[str, NameIndex] = {endpoint: NameIndex({}) for endpoint in ENDPOINTS}
+
+        self._metadata_cache = MetadataCache(os.path.join(settings.data_dir, "metadata_cache.json"), self.base_url)
+        self._metadata_lock = threading.Lock()
+        self._metadata_checked_at: float = 0.0
+
+        # Shared by all worker threads, limits parallel requests to paperless
+        self._io_slots = threading.BoundedSemaphore(settings.paperless_concurrency)
+        self.session = build_session(settings.paperless_concurrency)
+        self.session.headers.update(self.headers)
+        # Serializes creation of tags/correspondents/types so parallel documents don't create duplicates
+        self._create_lock = threading.Lock()
+
+    def _request(self, method: str, url: str, timeout: float | None = None, **kwargs) -> requests.Response:
+        with self._io_slots:
+            return self.session.request(
+                method,
+                url,
+                timeout=(settings.http_connect_timeout, timeout or settings.paperless_timeout),
+                **kwargs
+            )
+
+    def refresh_metadata(self, force: bool = False):
+        """
+        Bring the name -> ID maps up to date.
+
+        Callers running close together (polling thread, a burst of webhooks) share one
+        refresh: while another thread refreshes they wait, and within
+        metadata_refresh_interval seconds of the last check nothing is fetched at all.
+        A full reload only happens without a cache or after metadata_cache_ttl, otherwise
+        only IDs that appeared since the last sync are fetched.
+        """
+        with self._metadata_lock:
+            now = time.time()
+            if not force and now - self._metadata_checked_at < settings.metadata_refresh_interval:
+                metrics.CACHE_REQUESTS.labels("metadata", "hit").inc()
+                return
+            metrics.CACHE_REQUESTS.labels("metadata", "miss").inc()
+
+            cache = self._metadata_cache
+            if force or not cache.load() or now - cache.full_sync_at > settings.metadata_cache_ttl:
+                self._full_metadata_sync()
+            else:
+                self._incremental_metadata_sync()
 
-    def refresh_metadata(self):
-        """Fetch all metadata to map names to IDs."""
+            self._tags_map = cache.name_map("tags")
+            self._correspondents_map = cache.name_map("correspondents")
+            self._types_map = cache.name_map("document_types")
+            self._name_indexes = {endpoint: NameIndex(self._name_map(endpoint)) for endpoint in ENDPOINTS}
+            self._processed_cf_id = cache.processed_cf_id
+            cache.save()
+            self._metadata_checked_at = now
+            logger.info(f"Loaded metadata: {len(self._tags_map)} tags, {len(self._correspondents_map)} correspondents.")
+
+    def _full_metadata_sync(self):
         logger.info("Loading metadata, this can take a minute or more..")
-        self._tags_map = self._fetch_all_pages("tags")
-        self._correspondents_map = self._fetch_all_pages("correspondents")
-        self._types_map = self._fetch_all_pages("document_types")
-        self._processed_cf_id = self._get_ai_processed_cf_id()
-        logger.info(f"Loaded metadata: {len(self._tags_map)} tags, {len(self._correspondents_map)} correspondents.")
-
-    def _fetch_all_pages(self, endpoint: str) -> Dict[str, int]:
-        """Helper to get all items from paginated API and map Name -> ID."""
-        mapping = {}
+        cache = self._metadata_cache
+        for endpoint in ENDPOINTS:
+            cache.items[endpoint] = self._fetch_all_pages(endpoint)
+        cache.processed_cf_id = self._get_ai_processed_cf_id()
+        cache.full_sync_at = time.time()
+        cache.loaded = True
+
+    def _incremental_metadata_sync(self):
+        """Compare cached IDs with the ID list Paperless returns and fetch only new items."""
+        cache = self._metadata_cache
+        for endpoint in ENDPOINTS:
+            current_ids = self._fetch_all_ids(endpoint)
+            if current_ids is None:
+                logger.info(f"Paperless did not return the ID list for {endpoint}, doing a full reload")
+                self._full_metadata_sync()
+                return
+
+            items = cache.items[endpoint]
+            removed = set(items) - current_ids
+            added = current_ids - set(items)
+            for id_ in removed:
+                del items[id_]
+            if added:
+                items.update(self._fetch_by_ids(endpoint, sorted(added)))
+            if added or removed:
+                logger.info(f"Metadata {endpoint}: {len(added)} new, {len(removed)} removed since last sync")
+
+        if not cache.processed_cf_id:
+            cache.processed_cf_id = self._get_ai_processed_cf_id()
+
+    def _fetch_all_ids(self, endpoint: str) -> Optional[set]:
+        """Cheap probe: Paperless includes the IDs of all matching items in every list response."""
+        resp = self._request("GET", f"{self.base_url}/api/{endpoint}/", params={"page_size": 1})
+        resp.raise_for_status()
+        all_ids = resp.json().get('all')
+        return set(all_ids) if all_ids is not None else None
+
+    def _fetch_by_ids(self, endpoint: str, ids: List[int], chunk_size: int = 100) -> Dict[int, str]:
+        items = {}
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            resp = self._request(
+                "GET",
+                f"{self.base_url}/api/{endpoint}/",
+                params={"id__in": ",".join(map(str, chunk)), "page_size": len(chunk)}
+            )
+            resp.raise_for_status()
+            for item in resp.json()['results']:
+                items[item['id']] = item['name']
+        return items
+
+    def _fetch_all_pages(self, endpoint: str) -> Dict[int, str]:
+        """Helper to get all items from paginated API and map ID -> Name."""
+        items = {}
         next_url = f"{self.base_url}/api/{endpoint}/"
         while next_url:
-            resp = requests.get(next_url, headers=self.headers)
+            resp = self._request("GET", next_url)
             resp.raise_for_status()
             data = resp.json()
             for item in data['results']:
-                mapping[item['name'].lower()] = item['id']
+                items[item['id']] = item['name']
             next_url = data['next']
-        return mapping
+        return items
 
 
     def get_document(self, doc_id: int) -> PaperlessDocument:
-        resp = requests.get(f"{self.base_url}/api/documents/{doc_id}/", headers=self.headers)
+        resp = self._request("GET", f"{self.base_url}/api/documents/{doc_id}/")
         resp.raise_for_status()
         return PaperlessDocument(**resp.json())
 
@@ -57,118 +162,139 @@ class PaperlessClient:
         Returns:
             The PDF file content as bytes
         """
-        resp = requests.get(
+        resp = self._request(
+            "GET",
             f"{self.base_url}/api/documents/{doc_id}/download/",
-            headers=self.headers
+            timeout=settings.paperless_download_timeout
         )
         resp.raise_for_status()
         return resp.content
 
-    def send_ocr(self, doc_id: int, ocr_text: str) -> bool:
+    def iter_documents_to_process(self, page_size: int = 100) -> Iterator[int]:
         """
-        Send OCR text to Paperless for a document.
-        
+        Yield IDs of documents that do NOT have the AI Processed custom field or is false,
+        following the pagination through the whole backlog. Only the ID is requested
+        to keep responses small.
+        """
+        return self.iter_document_ids(page_size=page_size)
+
+    def iter_document_ids(self, query: Optional[str] = None, unprocessed_only: bool = True,
+                          ordering: str = "-created", page_size: int = 100) -> Iterator[int]:
+        """
+        Yield IDs of documents, following the pagination. Only the ID is requested.
+
         Args:
-            doc_id: The document ID
-            ocr_text: The OCR text content to send
-            
-        Returns:
-            True if successful, False otherwise
+            query: paperless full text query, e.g. "created:[2019 to 2020]"
+            unprocessed_only: skip documents with AI Processed set
         """
-        resp = requests.patch(
-            f"{self.base_url}/api/documents/{doc_id}/",
-            headers=self.headers,
-            json={"content": ocr_text, "id": doc_id}
-        )
-        try:
+        params = {"ordering": ordering, "fields": "id", "page_size": page_size}
+        if unprocessed_only:
+            params["custom_field_query"] = json.dumps(["OR",[["AI Processed","exact","false"],["AI Processed","exists","false"]]])
+        if query:
+            params["query"] = query
+        next_url = f"{self.base_url}/api/documents/"
+        while next_url:
+            resp = self._request("GET", next_url, params=params)
             resp.raise_for_status()
-            logger.info(f"Successfully sent OCR for Document {doc_id}")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send OCR for document {doc_id}: {resp.text}")
-            return False
+            data = resp.json()
+            for d in data['results']:
+                yield d['id']
+            next_url = data['next']
+            params = None  # the next link already carries the query
 
-    def get_documents_to_process(self) -> List[PaperlessDocument]:
-        """Fetch documents that do NOT have the AI Processed custom field or is false"""
-        params = {
-            "custom_field_query": json.dumps(["OR",[["AI Processed","exact","false"],["AI Processed","exists","false"]]]),
-            "ordering": "-created",
-            "page_size": 20 # Process in batches
-        }
-        resp = requests.get(f"{self.base_url}/api/documents/", headers=self.headers, params=params)
-        resp.raise_for_status()
-        
-        docs = []
-        for d in resp.json()['results']:
-            docs.append(PaperlessDocument(**d))
-        return docs
+    def _name_map(self, endpoint: str) -> Dict[str, int]:
+        return {
+            "tags": self._tags_map,
+            "correspondents": self._correspondents_map,
+            "document_types": self._types_map,
+        }[endpoint]
 
-    def _get_or_create_correspondent(self, name: str) -> Optional[int]:
+    def _get_or_create(self, endpoint: str, name: str) -> Optional[int]:
         if not name: return None
         name_clean = name.strip()
         name_lower = name_clean.lower()
         
-        if name_lower in self._correspondents_map:
-            return self._correspondents_map[name_lower]
+        if name_lower in self._name_map(endpoint):
+            return self._name_map(endpoint)[name_lower]
         
-        # Create new
-        logger.info(f"Creating new correspondent: {name_clean}")
-        resp = requests.post(
-            f"{self.base_url}/api/correspondents/",
-            headers=self.headers,
-            json={"name": name_clean}
-        )
-        if resp.status_code == 201:
-            new_id = resp.json()['id']
-            self._correspondents_map[name_lower] = new_id
+        with self._create_lock:
+            # Another worker may have created it meanwhile
+            if name_lower in self._name_map(endpoint):
+                return self._name_map(endpoint)[name_lower]
+
+            # Reuse an existing item with a similar name, e.g. "Telekom Slovenije d.d." for "Telekom Slovenije".
+            # Spelling variants only for correspondents; similar tags and types are often different on purpose
+            threshold = settings.fuzzy_match_threshold if endpoint == "correspondents" else 1
+            match = self._name_indexes[endpoint].find(name_clean, threshold)
+            if match:
+                logger.info(f"Using existing {ENTITY_LABELS[endpoint]} '{match[0]}' for '{name_clean}'")
+                return match[1]
+
+            # Create new
+            logger.info(f"Creating new {ENTITY_LABELS[endpoint]}: {name_clean}")
+            error = None
+            try:
+                resp = self._request(
+                    "POST",
+                    f"{self.base_url}/api/{endpoint}/",
+                    json={"name": name_clean}
+                )
+                new_id = resp.json()['id'] if resp.status_code == 201 else None
+            except requests.RequestException as e:
+                error, new_id = e, None
+            if new_id is None:
+                # A create that timed out or failed (e.g. "already exists") may have been done by paperless anyway
+                new_id = self._find_by_name(endpoint, name_clean)
+            if new_id is None:
+                if error:
+                    raise error
+                logger.error(f"Failed to create {ENTITY_LABELS[endpoint]} {name_clean}: {resp.text}")
+                return None
+            self._name_map(endpoint)[name_lower] = new_id
+            self._name_indexes[endpoint].add(name_lower, new_id)
             return new_id
-        return None
+
+    def _find_by_name(self, endpoint: str, name: str) -> Optional[int]:
+        resp = self._request("GET", f"{self.base_url}/api/{endpoint}/", params={"name__iexact": name})
+        resp.raise_for_status()
+        results = resp.json()['results']
+        return results[0]['id'] if results else None
+
+    def _get_or_create_correspondent(self, name: str) -> Optional[int]:
+        return self._get_or_create("correspondents", name)
 
     def _get_or_create_doctype(self, name: str) -> Optional[int]:
-        if not name: return None
-        name_clean = name.strip()
-        name_lower = name_clean.lower()
-        
-        if name_lower in self._types_map:
-            return self._types_map[name_lower]
-        
-        # Create new
-        logger.info(f"Creating new document type: {name_clean}")
-        resp = requests.post(
-            f"{self.base_url}/api/document_types/",
-            headers=self.headers,
-            json={"name": name_clean}
-        )
-        if resp.status_code == 201:
-            new_id = resp.json()['id']
-            self._types_map[name_lower] = new_id
-            return new_id
-        return None
+        return self._get_or_create("document_types", name)
     
     def _get_tag_ids(self, tag_names: List[str]) -> List[int]:
-        ids = []
-        for name in tag_names:
-            name_clean = name.strip()
-            name_lower = name_clean.lower()
-            if name_lower in self._tags_map:
-                ids.append(self._tags_map[name_lower])
-            else:
-                # Create new tag
-                logger.info(f"Creating new tag: {name_clean}")
-                resp = requests.post(
-                    f"{self.base_url}/api/tags/",
-                    headers=self.headers,
-                    json={"name": name_clean}
-                )
-                if resp.status_code == 201:
-                    new_id = resp.json()['id']
-                    self._tags_map[name_lower] = new_id
-                    ids.append(new_id)
-        return ids
+        ids = [self._get_or_create("tags", name) for name in tag_names]
+        return [id_ for id_ in ids if id_]
+
+    def create_missing(self, llm_results: List[Any]):
+        """
+        Pre-pass for a batch of LLM results: create every unknown correspondent,
+        document type and tag once, before any document is updated.
+        """
+        wanted = {"correspondents": set(), "document_types": set(), "tags": set()}
+        for llm_data in llm_results:
+            if llm_data.correspondent:
+                wanted["correspondents"].add(llm_data.correspondent.strip())
+            if llm_data.document_type:
+                wanted["document_types"].add(llm_data.document_type.strip())
+            wanted["tags"].update(tag.strip() for tag in llm_data.tags or [])
+
+        for endpoint, names in wanted.items():
+            # One request per distinct missing name, however many documents use it
+            missing = {}
+            for name in sorted(names):
+                if name and name.lower() not in self._name_map(endpoint):
+                    missing.setdefault(name.lower(), name)
+            for name in missing.values():
+                self._get_or_create(endpoint, name)
 
     def _get_ai_processed_cf_id(self) -> int:
         url = f"{self.base_url}/api/custom_fields/"
-        resp = requests.get(url, headers=self.headers, params={"name__iexact": "AI Processed"})
+        resp = self._request("GET", url, params={"name__iexact": "AI Processed"})
         resp.raise_for_status()
         data = resp.json()
         for item in data['results']:
@@ -180,22 +306,26 @@ class PaperlessClient:
 
     def _create_custom_field(self, name: str, data_type: str):
         url = f"{self.base_url}/api/custom_fields/"
-        resp = requests.post(url, headers=self.headers, json={"name": name, "data_type": data_type})
+        resp = self._request("POST", url, json={"name": name, "data_type": data_type})
         resp.raise_for_status()
 
-    def update_document(self, doc: PaperlessDocument, llm_data: Any):
+    def build_update_payload(self, doc: PaperlessDocument, llm_data: Any, ocr_text: Optional[str] = None) -> Dict[str, Any]:
         """
-        Maps LLM strings to IDs and updates the document.
+        Maps LLM strings to IDs and builds the PATCH payload for a document.
+        Title, date and OCR text are only included when they differ from the current values.
         """
         
         payload = {}
         
         # Map fields
-        if llm_data.title:
+        if llm_data.title and llm_data.title != doc.title:
             payload['title'] = llm_data.title
         
-        if llm_data.created:
+        if llm_data.created and llm_data.created != doc.created[:len(llm_data.created)]:
             payload['created'] = llm_data.created
+
+        if ocr_text is not None and ocr_text != doc.content:
+            payload['content'] = ocr_text
             
         if llm_data.correspondent:
             c_id = self._get_or_create_correspondent(llm_data.correspondent)
@@ -206,21 +336,54 @@ class PaperlessClient:
             if dt_id: payload['document_type'] = dt_id
             
         # Handle Tags (Merge existing + LLM tags + AI tag)
-        new_tag_ids = self._get_tag_ids(llm_data.tags)
+        new_tag_ids = self._get_tag_ids(llm_data.tags or [])
         existing_tags = doc.tags if not settings.override_existing_tags else []
         final_tags = list(set(existing_tags + new_tag_ids))
         payload['tags'] = final_tags
 
         payload['custom_fields'] = [{'field': self._processed_cf_id, 'value': True}]
+        return payload
 
-        logger.info(f"Updating Document {doc.id}...")
-        resp = requests.patch(
-            f"{self.base_url}/api/documents/{doc.id}/",
-            headers=self.headers,
+    def update_document(self, doc: PaperlessDocument, llm_data: Any, ocr_text: Optional[str] = None) -> bool:
+        """
+        Maps LLM strings to IDs and updates the document, OCR text and metadata in one request.
+
+        Returns:
+            True if successful, False otherwise
+        """
+        return self.patch_document(doc.id, self.build_update_payload(doc, llm_data, ocr_text))
+
+    def patch_document(self, doc_id: int, payload: Dict[str, Any]) -> bool:
+        logger.info(f"Updating Document {doc_id}...")
+        resp = self._request(
+            "PATCH",
+            f"{self.base_url}/api/documents/{doc_id}/",
             json=payload
         )
         try:
             resp.raise_for_status()
-            logger.info(f"Successfully updated Document {doc.id}")
+            logger.info(f"Successfully updated Document {doc_id}")
+            return True
         except Exception as e:
-            logger.error(f"Failed to update document {doc.id}: {resp.text}")
+            logger.error(f"Failed to update document {doc_id}: {resp.text}")
+            return False
+
+    def bulk_edit(self, doc_ids: List[int], method: str, parameters: Dict[str, Any]) -> bool:
+        """
+        Apply one bulk_edit operation (set_correspondent, modify_tags, ...) to many documents.
+
+        Returns:
+            True if successful, False otherwise
+        """
+        resp = self._request(
+            "POST",
+            f"{self.base_url}/api/documents/bulk_edit/",
+            json={"documents": doc_ids, "method": method, "parameters": parameters}
+        )
+        try:
+            resp.raise_for_status()
+            logger.info(f"Bulk {method} applied to {len(doc_ids)} document(s)")
+            return True
+        except Exception as e:
+            logger.error(f"Bulk {method} failed for documents {doc_ids}: {resp.text}")
+            return False
@@ -0,0 +1,162 @@
+import base64
+import io
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterator, List, Optional, Tuple
+from PIL import Image
+from pdf2image import convert_from_path
+from src.config import settings
+from src.utils import logger
+from src import metrics
+
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = 1
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by all workers for CPU-heavy page preparation, so that
+    rendering and encoding neither hold the GIL nor block the webhook server.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None:
+            _pool_workers = settings.preprocess_workers or min(os.cpu_count() or 1, 4)
+            # spawn instead of fork: the parent runs worker threads that may hold locks
+            _pool = ProcessPoolExecutor(max_workers=_pool_workers, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"Started {_pool_workers} page preprocessing process(es)")
+        return _pool
+
+
+def image_options() -> dict:
+    """Settings that determine what the prepared images look like (also part of the OCR cache key)."""
+    return {
+        "dpi": settings.pdf_dpi,
+        "grayscale": settings.pdf_grayscale,
+        "max_edge": settings.pdf_max_edge,
+        "image_format": settings.pdf_image_format,
+        "jpeg_quality": settings.pdf_jpeg_quality,
+    }
+
+
+def render_pages(pdf_path: str, first_page: int, last_page: int, dpi: int, grayscale: bool,
+                 max_edge: int, image_format: str, jpeg_quality: int) -> Tuple[List[str], float, float]:
+    """
+    Render a range of pages, shrink them to max_edge and encode them as base64
+    PNG or JPEG, in a pool process.
+
+    Returns:
+        The encoded pages and the seconds spent rendering and encoding
+    """
+    start = time.perf_counter()
+    images = convert_from_path(pdf_path, dpi=dpi, grayscale=grayscale, first_page=first_page, last_page=last_page)
+    rendered = time.perf_counter()
+    pages = []
+    for image in images:
+        if max_edge and max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        buffered = io.BytesIO()
+        if image_format == "jpeg":
+            image.convert("L" if grayscale else "RGB").save(buffered, format="JPEG", quality=jpeg_quality)
+        else:
+            image.save(buffered, format="PNG")
+        pages.append(base64.b64encode(buffered.getvalue()).decode('utf-8'))
+    return pages, rendered - start, time.perf_counter() - rendered
+
+
+def text_layer_pages(pdf_bytes: bytes, page_count: int) -> List[Optional[str]]:
+    """
+    Embedded text of every page, or None for pages without a usable text layer
+    (scans, or less than text_layer_min_chars characters of mostly letters and digits).
+    """
+    if not settings.text_layer_min_chars:
+        return [None] * page_count
+    try:
+        with metrics.time_stage("text_layer"), tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+            pdf_file.write(pdf_bytes)
+            pdf_file.flush()
+            result = subprocess.run(
+                ["pdftotext", "-enc", "UTF-8", "-l", str(page_count), pdf_file.name, "-"],
+                capture_output=True, timeout=120, check=True
+            )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Could not read the text layer, using vision OCR for all pages: {e}")
+        return [None] * page_count
+
+    # pdftotext ends every page with a form feed
+    texts = result.stdout.decode("utf-8", errors="replace").split("\f")
+    pages = []
+    for page in range(page_count):
+        text = texts[page].strip() if page < len(texts) else ""
+        pages.append(text if _is_dense(text) else None)
+    return pages
+
+
+def _is_dense(text: str) -> bool:
+    chars = [ch for ch in text if not ch.isspace()]
+    if len(chars) < settings.text_layer_min_chars:
+        return False
+    # Fonts without a unicode mapping extract as symbols or replacement characters
+    return sum(ch.isalnum() for ch in chars) / len(chars) >= 0.5
+
+
+def iter_page_images(pdf_bytes: bytes, page_count: int, pages: Optional[List[int]] = None) -> Iterator[str]:
+    """
+    Yield the pages of a PDF (or the given page numbers only) as base64 images ready for ollama.
+
+    Pages are prepared pdf_render_chunk at a time in the process pool, with one
+    chunk per pool process in flight ahead of the consumer, so all cores are used
+    while only a few pages are held in memory regardless of document length.
+    """
+    pages = pages if pages is not None else list(range(1, page_count + 1))
+    logger.info(f"Converting {len(pages)} of {page_count} PDF page(s) to images for OCR...")
+    pool = get_pool()
+    options = image_options()
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+        pdf_file.write(pdf_bytes)
+        pdf_file.flush()
+
+        ranges = iter(_page_ranges(pages, max(settings.pdf_render_chunk, 1)))
+        in_flight: Deque[Future] = deque()
+
+        def submit_next():
+            page_range = next(ranges, None)
+            if page_range is not None:
+                in_flight.append(pool.submit(render_pages, pdf_file.name, *page_range, **options))
+
+        for _ in range(_pool_workers):
+            submit_next()
+        try:
+            while in_flight:
+                current = in_flight.popleft()
+                submit_next()
+                try:
+                    pages, render_seconds, encode_seconds = current.result()
+                except Exception as e:
+                    metrics.ERRORS.labels("rasterize", type(e).__name__).inc()
+                    raise
+                metrics.STAGE_SECONDS.labels("rasterize").observe(render_seconds)
+                metrics.STAGE_SECONDS.labels("encode").observe(encode_seconds)
+                yield from pages
+        finally:
+            # The consumer stopped early (failed page), don't render for nothing
+            for future in in_flight:
+                future.cancel()
+
+
+def _page_ranges(pages: List[int], chunk: int) -> List[Tuple[int, int]]:
+    """Split sorted page numbers into (first, last) runs of consecutive pages, at most chunk long."""
+    ranges = []
+    for page in pages:
+        if ranges and page == ranges[-1][1] + 1 and page - ranges[-1][0] < chunk:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
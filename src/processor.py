@@ -1,66 +1,172 @@
 import time
+from typing import Optional, Tuple
 from src.config import settings
 from src.paperless_client import PaperlessClient
 from src.llm_client import OllamaClient
-from src.utils import logger, pdf_to_images, get_user_prompt
+from src.job_queue import JobQueue
+from src.scheduler import AdaptiveScheduler
+from src import metrics
+from src.utils import logger, pdf_page_count, get_user_prompt
+from src.preprocess import iter_page_images, text_layer_pages
+from src.checkpoints import get_checkpoints
+from src.bulk_updater import get_bulk_applier
+from src.models import LLMResponse, PaperlessDocument
 
 def process_single_document(doc_id: int, 
                             prompt: str, 
                             p_client: PaperlessClient, 
                             o_client: OllamaClient, 
-                            dry_run: bool):
+                            dry_run: bool) -> bool:
+    """Process one document. Returns True if it was classified and updated successfully."""
     try:
         logger.info(f"Processing Document {doc_id}")
-        
+        with metrics.time_stage("document"):
+            ok = _process(doc_id, prompt, p_client, o_client, dry_run)
+        metrics.DOCUMENTS.labels("success" if ok else "failed").inc()
+        return ok
+
+    except Exception as e:
+        metrics.DOCUMENTS.labels("failed").inc()
+        logger.error(f"Error processing document {doc_id}: {e}", exc_info=True)
+        return False
+
+
+def _process(doc_id: int, prompt: str, p_client: PaperlessClient, o_client: OllamaClient, dry_run: bool) -> bool:
+    doc, llm_result, ocr_text, ocr_key = classify_document(doc_id, prompt, p_client, o_client)
+    logger.info(f"LLM Suggestions: {llm_result.model_dump_json()}")
+    
+    if dry_run:
+        logger.warning("Not updating document due to dry run")
+        # The next run may use another prompt, don't resume from this classification
+        get_checkpoints().clear(doc_id)
+        return True
+    
+    logger.info(f"Updating Document {doc.id}: '{doc.title}'")
+    with metrics.time_stage("update"):
+        if settings.bulk_update_size > 1:
+            applied = get_bulk_applier(p_client).apply(doc, llm_result, ocr_text)
+        else:
+            applied = p_client.update_document(doc, llm_result, ocr_text)
+    if applied:
+        get_checkpoints().clear(doc_id, ocr_key)
+    return applied
+
+
+def classify_document(doc_id: int, prompt: str, p_client: PaperlessClient,
+                      o_client: OllamaClient) -> Tuple[PaperlessDocument, LLMResponse, str, Optional[str]]:
+    """
+    Fetch, OCR and classify a document without updating it.
+
+    Returns:
+        The document, the classification, the OCR text and the OCR cache key
+        (to clear the checkpoints with once the result is applied)
+    """
+    with metrics.time_stage("fetch"):
         doc = p_client.get_document(doc_id)
 
-        if settings.ocr_source == 'llm':
+    checkpoints = get_checkpoints()
+    ocr_key = None
+    if settings.ocr_source == 'llm':
+        with metrics.time_stage("download"):
             pdf_bytes = p_client.get_original_pdf(doc_id)
-            images = pdf_to_images(pdf_bytes)
-            if len(images) > settings.llm_ocr_source_page_limit:
-                logger.warning(f"Document {doc_id} has {len(images)} pages which is more than configured limit {settings.llm_ocr_source_page_limit}. Falling back to paperless OCR.")
-                ocr_text = doc.content
-            else:
-                logger.info(f"Retrieved PDF for Document {doc_id} ({len(pdf_bytes)} bytes)")
-                ocr_text = o_client.perform_ocr(images)
-        else:
+            page_count = pdf_page_count(pdf_bytes)
+        if page_count > settings.llm_ocr_source_page_limit:
+            logger.warning(f"Document {doc_id} has {page_count} pages which is more than configured limit {settings.llm_ocr_source_page_limit}. Falling back to paperless OCR.")
             ocr_text = doc.content
+        else:
+            logger.info(f"Retrieved PDF for Document {doc_id} ({len(pdf_bytes)} bytes)")
+            # Pages of born-digital PDFs already carry their text, only the others need vision OCR
+            page_texts = text_layer_pages(pdf_bytes, page_count)
+            text_layer = sum(text is not None for text in page_texts)
+            # Pages OCR-ed before a restart or a failed attempt are not sent again
+            ocr_key = o_client.ocr_cache_key(pdf_bytes)
+            done = checkpoints.ocr_pages(ocr_key)
+            page_texts = [text if text is not None else done.get(page) for page, text in enumerate(page_texts, start=1)]
+            scanned = [page for page, text in enumerate(page_texts, start=1) if text is None]
+            resumed = page_count - text_layer - len(scanned)
+            logger.info(f"{text_layer} of {page_count} page(s) have a text layer"
+                        + (f", {resumed} were OCR-ed before" if resumed else ""))
+            metrics.PAGES.labels("text_layer").inc(text_layer)
+            metrics.PAGES.labels("checkpoint").inc(resumed)
+            metrics.PAGES.labels("vision").inc(len(scanned))
+            with metrics.time_stage("ocr"):
+                ocr_text = o_client.perform_ocr(
+                    iter_page_images(pdf_bytes, page_count, scanned) if scanned else [],
+                    page_count,
+                    cache_key=ocr_key,
+                    page_texts=page_texts,
+                    on_page=lambda page, text: checkpoints.save_page(ocr_key, page, text)
+                )
+    else:
+        ocr_text = doc.content
 
-        # Process the OCR text with LLM for classification
-        llm_result = o_client.process_document(prompt, ocr_text)
-        logger.info(f"LLM Suggestions: {llm_result.model_dump_json()}")
-        
-        if dry_run:
-            logger.warning("Not updating document due to dry run")
-            return
-        
-        logger.info(f"Updating Document {doc.id}: '{doc.title}'")
-        p_client.send_ocr(doc_id, ocr_text)
-        p_client.update_document(doc, llm_result)
+    if o_client.taxonomy:
+        # Only the tags and correspondents closest to this document go into the prompt
+        with metrics.time_stage("shortlist"):
+            prompt = get_user_prompt(p_client, o_client.taxonomy.shortlist(p_client, ocr_text))
+
+    # Process the OCR text with LLM for classification, unless a previous attempt got that far
+    text_key = o_client.classification_key(prompt, ocr_text)
+    if (saved := checkpoints.classification(doc_id, text_key)) is not None:
+        logger.info(f"Resuming document {doc_id} from its saved classification")
+        llm_result = LLMResponse.model_validate_json(saved)
+    else:
+        with metrics.time_stage("classify"):
+            if o_client.batcher and len(ocr_text) <= settings.batch_classify_max_chars:
+                llm_result = o_client.batcher.classify(doc_id, prompt, ocr_text)
+            else:
+                llm_result = o_client.process_document(prompt, ocr_text)
+        checkpoints.save_classification(doc_id, text_key, llm_result.model_dump_json())
+    return doc, llm_result, ocr_text, ocr_key
 
-    except Exception as e:
-        logger.error(f"Error processing document {doc_id}: {e}", exc_info=True)
 
+def process_queued_document(doc_id: int,
+                            p_client: PaperlessClient,
+                            o_client: OllamaClient,
+                            dry_run: bool) -> bool:
+    """Queue handler, metadata and prompt are refreshed per job (cheap thanks to the metadata cache)."""
+    with metrics.time_stage("metadata_refresh"):
+        p_client.refresh_metadata()
+    prompt = get_user_prompt(p_client)
+    return process_single_document(doc_id, prompt, p_client, o_client, dry_run)
 
-def run_auto_mode(p_client: PaperlessClient, o_client: OllamaClient, dry_run: bool):
-    """Continuous loop for docker usage"""
-    logger.info(f"Starting automatic mode (Interval: {settings.scan_interval}s)")
+
+def run_auto_mode(p_client: PaperlessClient, queue: JobQueue, scheduler: AdaptiveScheduler):
+    """
+    Continuous loop for docker usage, queues unprocessed documents for the queue workers.
+
+    At most BACKLOG_BATCH_SIZE new documents are queued per scan. If there were more,
+    the next scan starts as soon as the workers are almost out of work; otherwise
+    the scheduler decides how long to wait (see AdaptiveScheduler).
+    """
+    logger.info(f"Starting automatic mode (Interval: {settings.scan_min_interval}-{settings.scan_interval}s)")
     
     while True:
+        scheduler.wait_for_capacity()
+        queued = 0
+        backlog = False
         try:
-            docs = p_client.get_documents_to_process()
+            found = 0
+            for doc_id in p_client.iter_documents_to_process():
+                found += 1
+                if queue.enqueue(doc_id, "scan"):
+                    queued += 1
+                    if queued >= settings.backlog_batch_size:
+                        backlog = True
+                        break
             
-            if not docs:
+            if not found:
                 logger.info("No new documents found.")
             else:
-                logger.info(f"Found {len(docs)} documents to process.")
-                p_client.refresh_metadata()
-                prompt = get_user_prompt(p_client)
-                for doc in docs:
-                    process_single_document(doc.id, prompt, p_client, o_client, dry_run)
+                logger.info(f"Found {found} documents to process, {queued} newly queued.")
         
         except Exception as e:
             logger.error(f"Error in auto loop: {e}")
+
+        delay = scheduler.next_delay(queued, backlog)
+        if backlog:
+            logger.info("More documents are waiting, scanning again once the queue runs low...")
+            continue
         
-        logger.info(f"Sleeping for {settings.scan_interval} seconds...")
-        time.sleep(settings.scan_interval)
+        logger.info(f"Sleeping for {delay} seconds...")
+        time.sleep(delay)
@@ -0,0 +1,97 @@
+import math
+from collections import Counter
+from src.config import settings
+from src.utils import logger
+from src import metrics
+
+# Context size ollama uses when num_ctx is not set
+OLLAMA_DEFAULT_NUM_CTX = 2048
+# Room for the chat template tokens ollama adds around the system prompt and the OCR text
+PROMPT_OVERHEAD_TOKENS = 32
+TRUNCATION_MARKER = "\n[...]\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count from the character count (PROMPT_CHARS_PER_TOKEN)."""
+    return math.ceil(len(text) / settings.prompt_chars_per_token)
+
+
+def fit_ocr_text(prompt: str, ocr_text: str) -> tuple[str, dict]:
+    """
+    Shrink the OCR text so prompt + OCR text + the reserved output fit into num_ctx.
+
+    Ollama drops the beginning of a prompt that does not fit, which would remove
+    the instructions. Instead, lines repeated across pages (headers, footers,
+    boilerplate) are removed first, and if the text is still too long, the
+    beginning (first pages) and a shorter end of the document are kept.
+
+    Returns:
+        The OCR text to send and a report of the token budget
+
+    Raises:
+        ValueError: if the prompt leaves no room for the OCR text; classifying an
+            empty document would only invent a title and tags
+    """
+    num_ctx = settings.ollama_num_ctx or OLLAMA_DEFAULT_NUM_CTX
+    prompt_tokens = estimate_tokens(prompt)
+    budget = num_ctx - settings.prompt_output_reserve - prompt_tokens - PROMPT_OVERHEAD_TOKENS
+    original_tokens = estimate_tokens(ocr_text)
+
+    text = ocr_text
+    if original_tokens > budget:
+        text = _remove_repeated_lines(text)
+        if estimate_tokens(text) > budget:
+            text = _keep_head_and_tail(text, int(budget * settings.prompt_chars_per_token))
+    if budget <= 0 or (ocr_text.strip() and not text.strip()):
+        raise ValueError(
+            f"Prompt alone needs ~{prompt_tokens} tokens, which leaves no room for the document "
+            f"in num_ctx {num_ctx}. Increase OLLAMA_NUM_CTX or shorten the prompt."
+        )
+
+    report = {
+        "num_ctx": num_ctx,
+        "prompt_tokens": prompt_tokens,
+        "ocr_tokens": estimate_tokens(text),
+        "ocr_tokens_original": original_tokens,
+        "output_reserve": settings.prompt_output_reserve,
+        "truncated": text != ocr_text,
+    }
+    used = report["prompt_tokens"] + report["ocr_tokens"] + PROMPT_OVERHEAD_TOKENS
+    logger.info(
+        f"Prompt budget: ~{used}/{num_ctx - settings.prompt_output_reserve} tokens "
+        f"(instructions {prompt_tokens}, OCR {report['ocr_tokens']} of {original_tokens})"
+    )
+    metrics.PROMPT_TOKENS.labels("instructions").observe(prompt_tokens)
+    metrics.PROMPT_TOKENS.labels("ocr").observe(report["ocr_tokens"])
+    if report["truncated"]:
+        metrics.PROMPT_TRUNCATIONS.inc()
+    return text, report
+
+
+def _remove_repeated_lines(text: str, min_length: int = 8, min_repeats: int = 3) -> str:
+    """Keep only the first occurrence of lines that repeat on many pages."""
+    lines = text.splitlines()
+    counts = Counter(line.strip() for line in lines if len(line.strip()) >= min_length)
+    repeated = {line for line, count in counts.items() if count >= min_repeats}
+    seen = set()
+    kept = []
+    for line in lines:
+        key = line.strip()
+        if key in repeated:
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def _keep_head_and_tail(text: str, max_chars: int) -> str:
+    """Keep the first pages (sender, date, subject) and the end (totals, signatures)."""
+    max_chars -= len(TRUNCATION_MARKER)
+    if max_chars <= 0:
+        return ""
+    tail_chars = int(max_chars * settings.prompt_tail_fraction)
+    head_chars = max_chars - tail_chars
+    head = text[:head_chars]
+    tail = text[len(text) - tail_chars:] if tail_chars else ""
+    return head + TRUNCATION_MARKER + tail
@@ -0,0 +1,65 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from src.utils import logger
+from src import metrics
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of OCR text and classification results, persisted in SQLite.
+
+    Keys are content hashes, so a reprocessed document with unchanged input
+    costs a lookup instead of another round of LLM calls.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Hash of all parts; str parts are UTF-8 encoded, None and numbers are stringified."""
+        digest = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, bytes):
+                part = str(part).encode("utf-8")
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def get(self, key: str, kind: str) -> Optional[str]:
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        metrics.CACHE_REQUESTS.labels(kind, "miss" if row is None else "hit").inc()
+        if row is None:
+            return None
+        logger.info(f"Using cached {kind} result")
+        return row[0]
+
+    def put(self, key: str, kind: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, kind, value, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, kind, value, time.time())
+            )
+            # Evict least recently used entries above the limit
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed_at "
+                "LIMIT MAX(0, (SELECT COUNT(*) FROM results) - ?))",
+                (self.max_entries,)
+            )
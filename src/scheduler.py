@@ -0,0 +1,65 @@
+import threading
+import time
+from src.config import settings
+from src.job_queue import JobQueue
+from src.llm_client import OllamaClient
+from src.utils import logger
+
+
+class AdaptiveScheduler:
+    """
+    Decides when auto mode scans paperless for new documents.
+
+    - While a backlog remains, the next scan starts as soon as the workers are
+      almost out of work.
+    - When a scan finds nothing new, the wait doubles from SCAN_MIN_INTERVAL up to
+      SCAN_INTERVAL, and drops back once documents show up again.
+    - While webhooks arrive (one within the last WEBHOOK_SCAN_INTERVAL), they deliver
+      new documents and scanning only catches missed ones, every WEBHOOK_SCAN_INTERVAL.
+    - No new work is queued while ollama is busy with other models (see OllamaClient.gpu_busy).
+    """
+
+    def __init__(self, queue: JobQueue, o_client: OllamaClient | None = None):
+        self.queue = queue
+        self.o_client = o_client
+        self._idle_scans = 0
+        self._last_webhook_at: float | None = None
+        self._lock = threading.Lock()
+
+    def note_webhook(self):
+        """Called for every received webhook."""
+        now = time.time()
+        with self._lock:
+            if not self._webhooks_healthy(now):
+                logger.info(f"Webhooks are arriving, scanning for missed documents every {settings.webhook_scan_interval}s")
+            self._last_webhook_at = now
+
+    def wait_for_capacity(self):
+        """Block until the workers are almost out of work and ollama is available to us."""
+        self.queue.wait_until_below(settings.workers)
+        if not (settings.scan_yield_gpu and self.o_client):
+            return
+        delay = settings.scan_min_interval
+        while self.o_client.gpu_busy():
+            logger.info(f"Ollama is busy with other models, not queuing new documents for {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, settings.scan_interval)
+
+    def next_delay(self, queued: int, backlog: bool) -> float:
+        """Seconds to wait before the next scan, given how many documents the last scan queued."""
+        if backlog:
+            self._idle_scans = 0
+            return 0
+        if queued:
+            self._idle_scans = 0
+            return settings.scan_min_interval
+
+        delay = min(settings.scan_min_interval * 2 ** self._idle_scans, settings.scan_interval)
+        self._idle_scans += 1
+        with self._lock:
+            if self._webhooks_healthy(time.time()):
+                delay = max(delay, settings.webhook_scan_interval)
+        return delay
+
+    def _webhooks_healthy(self, now: float) -> bool:
+        return self._last_webhook_at is not None and now - self._last_webhook_at <= settings.webhook_scan_interval
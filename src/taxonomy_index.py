@@ -0,0 +1,99 @@
+import os
+import re
+import threading
+from typing import Dict, List
+import numpy as np
+from src.config import settings
+from src.utils import logger, data_dir_writable
+
+
+class TaxonomyIndex:
+    """
+    Embeddings of tag and correspondent names, used to inject only the names
+    closest to a document into the prompt instead of the complete lists.
+
+    Name embeddings are cached on disk and only names added since the last
+    update are embedded, lookups are a single matrix-vector product.
+    """
+
+    def __init__(self, o_client):
+        self.o_client = o_client
+        model_slug = re.sub(r'[^\w.-]', '_', settings.ollama_embed_model)
+        self.path = os.path.join(settings.data_dir, f"embeddings-{model_slug}.npz")
+        self._lock = threading.Lock()
+        self._vectors: Dict[str, np.ndarray] = self._load()
+        self._names: Dict[str, List[str]] = {}
+        self._matrices: Dict[str, np.ndarray] = {}
+
+    def _load(self) -> Dict[str, np.ndarray]:
+        try:
+            data = np.load(self.path, allow_pickle=False)
+            return dict(zip(data["names"].tolist(), data["vectors"]))
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable embedding cache {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        if not data_dir_writable():
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        names = list(self._vectors)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, names=np.array(names), vectors=np.stack([self._vectors[n] for n in names]))
+        os.replace(tmp_path, self.path)
+
+    def update(self, names_by_kind: Dict[str, List[str]]):
+        """Embed names not seen before and rebuild the lookup matrices if the lists changed."""
+        with self._lock:
+            if all(self._names.get(kind) == names for kind, names in names_by_kind.items()):
+                return
+
+            wanted = {name for names in names_by_kind.values() for name in names}
+            missing = [name for name in wanted if name not in self._vectors]
+            if missing:
+                logger.info(f"Embedding {len(missing)} new metadata name(s)...")
+                batch = settings.taxonomy_embed_batch_size
+                for i in range(0, len(missing), batch):
+                    vectors = _normalize(self.o_client.embed(missing[i:i + batch]))
+                    self._vectors.update(zip(missing[i:i + batch], vectors))
+            removed = set(self._vectors) - wanted
+            for name in removed:
+                del self._vectors[name]
+            if missing or removed:
+                self._save()
+
+            for kind, names in names_by_kind.items():
+                self._names[kind] = list(names)
+                self._matrices[kind] = (
+                    np.stack([self._vectors[n] for n in names]) if names else np.zeros((0, 0), dtype=np.float32)
+                )
+
+    def shortlist(self, p_client, ocr_text: str) -> Dict[str, List[str]]:
+        """Top SHORTLIST_K names per kind, most similar to the document first."""
+        self.update({
+            "tags": list(p_client._tags_map.keys()),
+            "correspondents": list(p_client._correspondents_map.keys()),
+        })
+        doc_vector = _normalize(self.o_client.embed([ocr_text[:settings.taxonomy_doc_chars]]))[0]
+
+        k = settings.taxonomy_shortlist_k
+        result = {}
+        with self._lock:
+            for kind, matrix in self._matrices.items():
+                names = self._names[kind]
+                if len(names) <= k:
+                    result[kind] = names
+                    continue
+                scores = matrix @ doc_vector
+                top = np.argpartition(-scores, k)[:k]
+                top = top[np.argsort(-scores[top])]
+                result[kind] = [names[i] for i in top]
+        logger.debug(f"Shortlisted metadata: {result}")
+        return result
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
@@ -1,8 +1,11 @@
+import functools
+import itertools
 import logging
 import json
+import os
 import re
-from PIL import Image
-from pdf2image import convert_from_bytes
+import tempfile
+from pdf2image import pdfinfo_from_bytes
 from src.config import settings
 
 def setup_logging():
@@ -18,9 +21,34 @@ def setup_logging():
 
 logger = setup_logging()
 
+
+@functools.lru_cache(maxsize=None)
+def data_dir_writable() -> bool:
+    """Whether local state can be kept in DATA_DIR. Warns once if not."""
+    try:
+        os.makedirs(settings.data_dir, exist_ok=True)
+        with tempfile.TemporaryFile(dir=settings.data_dir):
+            pass
+        return True
+    except OSError as e:
+        logger.warning(
+            f"DATA_DIR {settings.data_dir} is not writable ({e}). Caches are disabled and the queue is only kept "
+            f"in memory until this is fixed, e.g. with 'chown 1000:1000 data' on the host."
+        )
+        return False
+
+
+def sqlite_path(name: str) -> str:
+    """Path of a SQLite database in DATA_DIR, or an in-memory database if DATA_DIR is not writable."""
+    return os.path.join(settings.data_dir, name) if data_dir_writable() else ":memory:"
+
 def extract_json_from_text(text: str) -> dict:
     """
     JSON extraction from LLM response. Handles markdown code blocks or raw JSON.
+
+    Text around the JSON is skipped: objects are located with JsonObjectScanner
+    (braces inside strings don't count) and the first one that parses is returned.
+    The response is scanned and decoded in place, without copying parts of it.
     """
     try:
         # Try raw parse first
@@ -28,29 +56,82 @@ def extract_json_from_text(text: str) -> dict:
     except json.JSONDecodeError:
         pass
 
-    # Look for markdown code blocks
-    match = re.search(r'```json\s*([\s\S]*?)\s*```', text)
-    if match:
-        try:
-            return json.loads(match.group(1))
-        except json.JSONDecodeError:
-            pass
-            
-    # Look for bracketed content
-    match = re.search(r'\{[\s\S]*\}', text)
-    if match:
-        try:
-            return json.loads(match.group(0))
-        except json.JSONDecodeError:
-            pass
+    decoder = json.JSONDecoder()
+    start = text.find('{')
+    while start != -1:
+        scanner = JsonObjectScanner()
+        if scanner.feed(text, start):
+            try:
+                return decoder.raw_decode(text, scanner.start)[0]
+            except json.JSONDecodeError:
+                # Balanced but not valid JSON, continue after it
+                start = text.find('{', scanner.end)
+        else:
+            # Never closed, e.g. a stray brace in prose before the object
+            start = text.find('{', start + 1)
 
     raise ValueError("Could not extract valid JSON from LLM response")
 
 
-def get_user_prompt(p_client):
+class JsonObjectScanner:
+    """
+    Incremental scanner that finds where the first top-level JSON object in a
+    stream of text ends, respecting braces inside strings.
+    """
+
+    def __init__(self):
+        self.start: int | None = None
+        self.end: int | None = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str, skip: int = 0) -> bool:
+        """
+        Consume the next chunk of text, ignoring its first `skip` characters.
+        Returns True once the object is complete.
+        """
+        self._pos += skip
+        for ch in itertools.islice(chunk, skip, None):
+            if self.end is not None:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self.start is None:
+                if ch == '{':
+                    self.start = self._pos
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = self._pos + 1
+            self._pos += 1
+        return self.end is not None
+
+
+def get_user_prompt(p_client, shortlist: dict | None = None):
+    """
+    Render prompt.txt with metadata lists from paperless.
+
+    Args:
+        p_client: PaperlessClient with loaded metadata
+        shortlist: optional names per endpoint ("tags", "correspondents") to inject
+            instead of the complete lists, see TaxonomyIndex
+    """
     with open(settings.prompt_file, 'r') as f:
         user_prompt_template = f.read()
 
+    shortlist = shortlist or {}
     replacable = re.findall(r'%\w+%', user_prompt_template)
     logger.info(f"Found the following variables to replace in prompt: {replacable}")
     to_replace = {}
@@ -58,7 +139,7 @@ def get_user_prompt(p_client):
         if vtag == "%TAGS%":
             user_prompt_template = user_prompt_template.replace(
                 vtag,
-                json.dumps(list(p_client._tags_map.keys()))
+                json.dumps(shortlist.get("tags", list(p_client._tags_map.keys())))
             )
         elif vtag == "%TYPES%":
             user_prompt_template = user_prompt_template.replace(
@@ -68,13 +149,11 @@ def get_user_prompt(p_client):
         elif vtag == "%CORRESPONDENTS%":
             user_prompt_template = user_prompt_template.replace(
                 vtag,
-                json.dumps(list(p_client._correspondents_map.keys()))
+                json.dumps(shortlist.get("correspondents", list(p_client._correspondents_map.keys())))
             )
     return user_prompt_template
 
 
-def pdf_to_images(pdf_bytes: bytes) -> list[Image.Image]:
-    logger.info("Converting PDF to images for OCR...")
-    images = convert_from_bytes(pdf_bytes)
-    logger.info(f"Converted PDF to {len(images)} page(s)")
-    return images
\ No newline at end of file
+def pdf_page_count(pdf_bytes: bytes) -> int:
+    """Read the page count from the PDF without rendering anything."""
+    return pdfinfo_from_bytes(pdf_bytes)["Pages"]
@@ -1,12 +1,14 @@
 import uvicorn
 import re
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
 from src.config import settings
-from src.paperless_client import PaperlessClient
-from src.llm_client import OllamaClient
-from src.utils import logger, get_user_prompt
-from src.processor import process_single_document
+from src.job_queue import JobQueue
+from src.scheduler import AdaptiveScheduler
+from src.utils import logger
 
 class WebhookPayload(BaseModel):
     document_id: int | None = None
@@ -28,21 +30,12 @@ class WebhookPayload(BaseModel):
         raise ValueError("No valid document ID or doc_url found in payload")
 
 
-def handle_webhook_task(doc_id: int, p_client: PaperlessClient, o_client: OllamaClient, dry_run: bool):
-    try:
-        p_client.refresh_metadata()
-        prompt = get_user_prompt(p_client)
-        process_single_document(doc_id, prompt, p_client, o_client, dry_run)
-    except Exception as e:
-        logger.error(f"Error in background task for document {doc_id}: {e}")
-
-
-def run_webhook_mode(p_client: PaperlessClient, o_client: OllamaClient, dry_run: bool):
+def run_webhook_mode(queue: JobQueue, scheduler: AdaptiveScheduler):
     """Starts a FastAPI server for webhooks."""
     app = FastAPI(title="PaperLlama Webhook Server")
 
     @app.post("/webhook")
-    async def handle_webhook(payload: WebhookPayload, background_tasks: BackgroundTasks):
+    async def handle_webhook(payload: WebhookPayload):
         try:
             doc_id = payload.get_id()
         except ValueError as e:
@@ -50,16 +43,29 @@ def run_webhook_mode(p_client: PaperlessClient, o_client: OllamaClient, dry_run:
             raise HTTPException(status_code=400, detail=str(e))
 
         logger.info(f"Webhook received for document {doc_id}")
+        scheduler.note_webhook()
         
-        # Schedule the processing task in the background
-        background_tasks.add_task(
-            handle_webhook_task, 
-            doc_id, 
-            p_client, 
-            o_client, 
-            dry_run
-        )
-        return {"status": "Processing scheduled", "document_id": doc_id}
+        # Queue workers pick it up, a document already waiting in the queue is not added twice.
+        # The queue is SQLite behind a lock, so keep it off the event loop.
+        if await run_in_threadpool(queue.enqueue, doc_id, "webhook"):
+            return {"status": "Processing scheduled", "document_id": doc_id}
+        return {"status": "Already queued", "document_id": doc_id}
+
+    @app.get("/queue")
+    async def queue_status():
+        return await run_in_threadpool(queue.stats)
+
+    @app.get("/health")
+    async def health():
+        # Only in-memory state, so it answers while workers are busy or the queue is locked
+        workers = queue.workers_alive()
+        if workers < settings.workers:
+            return JSONResponse({"status": "degraded", "workers": workers}, status_code=503)
+        return {"status": "ok", "workers": workers}
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
     logger.info(f"Starting webhook mode on {settings.webhook_host}:{settings.webhook_port}")
     uvicorn.run(app, host=settings.webhook_host, port=settings.webhook_port)